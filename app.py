@@ -1,11 +1,39 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context, g, make_response, send_file, send_from_directory, has_app_context, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta,timezone
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy.dialects import sqlite
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import Select
+from datetime import date, datetime, timedelta,timezone
+from werkzeug.http import parse_content_range_header
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
-from apscheduler.schedulers.background import BackgroundScheduler
-from twilio.rest import Client
 
+import click
 import os
+import io
+import csv
+import json
+import logging
+import time
+import uuid
+import hashlib
+import mimetypes
+import random
+import re
+import shutil
+import socket
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
+from types import MappingProxyType
+import base64
+import binascii
 from dotenv import load_dotenv
 
 load_dotenv()  # loads .env
@@ -13,17 +41,387 @@ load_dotenv()  # loads .env
 SECRET_KEY = os.getenv("SECRET_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL","sqlite:///local.db")
 
+# Database pooling. "serverless" opens a connection per request (NullPool) and
+# expects DATABASE_URL to point at an external pooler such as PgBouncer;
+# "worker" keeps a sized, pre-pinged pool for gunicorn and the CLI workers.
+DB_POOL_PROFILE = os.getenv("DB_POOL_PROFILE", "serverless" if os.getenv("VERCEL") else "worker")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # below the server/pooler idle timeout
+# Per-statement limit in Postgres for connections serving web requests; CLI
+# commands, migrations and background jobs run without one. 0 disables it.
+# Behind a transaction-mode pooler that rejects startup options, set it on
+# the web's database role instead and run maintenance with another role.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+# Optional read replicas (comma-separated URLs). Read-only pages and reports
+# (see @read_replica) query one of them; writes, the scheduler and the CLI
+# always use DATABASE_URL. After a POST the user stays on the primary for
+# REPLICA_PIN_SECONDS so replica lag never hides their own changes.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", "10"))
+
+# Opt-in request instrumentation: per-route timings on /metrics, slow
+# statements logged with parameters redacted, and an optional Server-Timing
+# header with the per-request breakdown.
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # if set, /metrics requires "Authorization: Bearer <token>"
+
+# Periodic jobs. "off" leaves them to dedicated `flask --app app run-scheduler`
+# (or per-job) processes; "embedded" also runs them in a thread in each web
+# worker. Either way a DB lock makes sure only one process runs a job at a time.
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "off")  # off or embedded
+SCHEDULER_SHARDS = int(os.getenv("SCHEDULER_SHARDS", "1"))  # split the status sweep by user_id range
+JOB_LOCK_BACKEND = os.getenv("JOB_LOCK_BACKEND", "auto")  # auto (advisory on Postgres), advisory or lease
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))  # lease fallback: renewed every third of this while a job runs
+
+# Closed requests and settled credit transactions older than this move to the
+# archive tables (see archive_history); history pages show them with ?archived=1
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+
+# Attachments on service requests. UPLOAD_STORE picks where their bytes live
+# ("local": files under UPLOAD_DIR, which must be a persistent disk shared by
+# every worker). Uploads arrive in chunks of at most UPLOAD_CHUNK_MB (kept
+# under serverless request body limits) and unfinished ones are dropped
+# after UPLOAD_EXPIRY_HOURS.
+UPLOAD_STORE = os.getenv("UPLOAD_STORE", "local")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+UPLOAD_CHUNK_MB = int(os.getenv("UPLOAD_CHUNK_MB", "4"))
+UPLOAD_EXPIRY_HOURS = int(os.getenv("UPLOAD_EXPIRY_HOURS", "24"))
+
+# Password hashing: any werkzeug method string, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000". Hashes stored with other parameters are upgraded
+# when their user next logs in. With PASSWORD_HASH_WORKERS > 0 at most that
+# many hashes run at once per process, and a login that can't get a slot
+# within PASSWORD_HASH_WAIT_SECONDS is turned away (503) instead of queueing.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))  # 0 leaves hashing unbounded
+PASSWORD_HASH_WAIT_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "2"))
+
+# Login throttling, per process (it protects this worker's CPU): attempts per
+# client IP and failed attempts per account within LOGIN_THROTTLE_WINDOW
+# seconds. Refused attempts are answered with 429 before any hashing; 0 disables.
+# The per-IP limit is off by default: behind a proxy every client shares the
+# proxy's address unless TRUSTED_PROXY_COUNT says how many X-Forwarded-For
+# hops to trust (1 for Vercel or a single nginx/load balancer).
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", "60"))
+LOGIN_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_ATTEMPTS_PER_IP", "0"))
+LOGIN_FAILURES_PER_ACCOUNT = int(os.getenv("LOGIN_FAILURES_PER_ACCOUNT", "5"))
+
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+
+# Per-process cache of the sidebar summary (name, credits) for logged-in users
+USER_SUMMARY_TTL = float(os.getenv("USER_SUMMARY_TTL", "30"))
+USER_SUMMARY_CACHE_SIZE = int(os.getenv("USER_SUMMARY_CACHE_SIZE", "2048"))
+
+# Live request statuses on /my_requests. Pages poll /api/status every
+# STATUS_POLL_SECONDS (an unchanged poll is a 304). STATUS_STREAM=1 switches
+# them to server-sent events, which hold a worker per open tab: only enable
+# it with async or threaded workers, never with sync workers or serverless.
+STATUS_POLL_SECONDS = int(os.getenv("STATUS_POLL_SECONDS", "10"))
+STATUS_STREAM = os.getenv("STATUS_STREAM", "0") == "1"
+
+# Browser/CDN cache lifetime for the public pages (home, about, services, pricing)
+PUBLIC_PAGE_MAX_AGE = int(os.getenv("PUBLIC_PAGE_MAX_AGE", "300"))
+
+# Notifications
+NOTIFY_TRANSPORT = os.getenv("NOTIFY_TRANSPORT", "twilio")  # twilio or stub
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_BACKOFF_SECONDS = int(os.getenv("NOTIFY_BACKOFF_SECONDS", "30"))
+NOTIFY_CLAIM_SECONDS = int(os.getenv("NOTIFY_CLAIM_SECONDS", "300"))  # a claimed batch is retried after this if its dispatcher dies
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "YOUR_TWILIO_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "YOUR_TWILIO_AUTH_TOKEN")
+TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM", "+14155238886")  # Twilio sandbox number
+
 app = Flask(__name__)
 
 app.secret_key = SECRET_KEY
 
+if TRUSTED_PROXY_COUNT:
+    # request.remote_addr becomes the client address the proxies forwarded
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT,
+                            x_host=TRUSTED_PROXY_COUNT)
+
+
+def database_engine_options(url, profile):
+    """Engine options for the pool profile; SQLite keeps SQLAlchemy's defaults."""
+    if profile not in ("serverless", "worker"):
+        raise ValueError(f"Unknown DB_POOL_PROFILE {profile!r}, expected 'serverless' or 'worker'")
+    if not url.startswith("postgres"):
+        return {}
+
+    options = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    if profile == "serverless":
+        # Frozen instances can't return connections, so don't hold any
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=QueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            pool_use_lifo=True,  # lets idle surplus connections age out
+        )
+    return options
+
 
 # configure SQL Alchemy
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database_engine_options(DATABASE_URL, DB_POOL_PROFILE)
+app.config["SQLALCHEMY_BINDS"] = {
+    f"replica_{i}": {"url": url, **database_engine_options(url, DB_POOL_PROFILE)}
+    for i, url in enumerate(DATABASE_REPLICA_URLS)
+}
+REPLICA_BINDS = tuple(app.config["SQLALCHEMY_BINDS"])
+
+
+class RoutingSession(BaseSession):
+    """
+    Sends plain SELECTs to a replica while the request has g.use_replica
+    set (kept on g rather than the session, which streamed responses
+    outlive). Flushes, INSERT/UPDATE/DELETE, raw SQL and SELECT ... FOR
+    UPDATE always go to the primary. One replica is picked per request so a
+    page doesn't mix reads from replicas at different lag.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and REPLICA_BINDS and has_app_context() and g.get('use_replica') and not self._flushing
+                and isinstance(clause, Select) and clause._for_update_arg is None):
+            return self._db.engines[g.setdefault('replica', random.choice(REPLICA_BINDS))]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+
+def _set_statement_timeout(dbapi_conn, record, proxy):
+    """
+    Connections start with the request timeout (see database_engine_options).
+    A checkout outside a request lifts it, and the next request checkout
+    puts it back; each is one SET, only when the setting has to change.
+    """
+    timeout = DB_STATEMENT_TIMEOUT_MS if has_request_context() else 0
+    if record.info.get('statement_timeout', DB_STATEMENT_TIMEOUT_MS) != timeout:
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"SET statement_timeout = {timeout}")
+        cursor.close()
+        dbapi_conn.commit()  # the pool's rollback on return would undo it
+        record.info['statement_timeout'] = timeout
+
+
+if DB_STATEMENT_TIMEOUT_MS:
+    with app.app_context():
+        for _engine in db.engines.values():
+            if _engine.dialect.name == 'postgresql':
+                event.listen(_engine, 'checkout', _set_statement_timeout)
+
+# Pool activity since the process started, reported by /healthz
+pool_events = {"connects": 0, "checkouts": 0, "invalidations": 0}
+_pool_events_lock = threading.Lock()
+
+
+def _count_pool_event(name):
+    with _pool_events_lock:
+        pool_events[name] += 1
+
+
+event.listen(Pool, 'connect', lambda dbapi_conn, record: _count_pool_event('connects'))
+event.listen(Pool, 'checkout', lambda dbapi_conn, record, proxy: _count_pool_event('checkouts'))
+event.listen(Pool, 'invalidate', lambda dbapi_conn, record, exc: _count_pool_event('invalidations'))
+
+
+def pool_status():
+    pool = db.engine.pool
+    status = {"profile": DB_POOL_PROFILE, "pool": type(pool).__name__, **pool_events}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    return status
+
+
+# Request metrics, per endpoint. Counts are per process; Prometheus sums
+# them across workers when scraping each one.
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+request_metrics = {}
+slow_query_count = 0
+_metrics_lock = threading.Lock()
+slow_query_log = logging.getLogger("creativehub.slow_query")
+
+
+def redact_parameters(parameters):
+    """Keep the shape of bound parameters (names and types) but not their values."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return [redact_parameters(parameters[0]), f"... {len(parameters)} rows"]
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+# The start time lives on the statement's execution context, which is
+# discarded with it, so a statement that raises leaves nothing behind.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global slow_query_count
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if has_request_context() and 'request_started' in g:
+        g.db_time += elapsed
+        g.db_queries += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        with _metrics_lock:
+            slow_query_count += 1
+        slow_query_log.warning(
+            "Slow query (%.1f ms) on %s: %s params=%s",
+            elapsed * 1000,
+            request.endpoint if has_request_context() else "background",
+            " ".join(statement.split()),
+            redact_parameters(parameters),
+        )
+
+
+def _before_render(sender, template, context, **extra):
+    if 'request_started' in g:
+        g.render_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    if 'request_started' in g and 'render_started' in g:
+        g.render_time += time.perf_counter() - g.pop('render_started')
+
+
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_time = 0.0
+    g.db_queries = 0
+    g.render_time = 0.0
+
+
+def _record_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+
+    with _metrics_lock:
+        stats = request_metrics.get(endpoint)
+        if stats is None:
+            stats = request_metrics[endpoint] = {
+                "statuses": {}, "buckets": [0] * len(REQUEST_DURATION_BUCKETS),
+                "count": 0, "seconds": 0.0, "db_seconds": 0.0, "queries": 0, "render_seconds": 0.0,
+            }
+        key = (request.method, response.status_code)
+        stats["statuses"][key] = stats["statuses"].get(key, 0) + 1
+        for i, bound in enumerate(REQUEST_DURATION_BUCKETS):
+            if elapsed <= bound:
+                stats["buckets"][i] += 1
+        stats["count"] += 1
+        stats["seconds"] += elapsed
+        stats["db_seconds"] += g.db_time
+        stats["queries"] += g.db_queries
+        stats["render_seconds"] += g.render_time
+
+    if SERVER_TIMING_HEADER:
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'db;dur={g.db_time * 1000:.1f};desc="{g.db_queries} queries", '
+            f'render;dur={g.render_time * 1000:.1f}'
+        )
+    return response
+
+
+if INSTRUMENTATION:
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
 
 
-db = SQLAlchemy(app)
+def render_metrics():
+    """Request, query and pool metrics in the Prometheus text format."""
+    lines = [
+        "# HELP creativehub_http_requests_total Requests handled, by endpoint, method and status.",
+        "# TYPE creativehub_http_requests_total counter",
+    ]
+    with _metrics_lock:
+        snapshot = {endpoint: {**stats, "statuses": dict(stats["statuses"]), "buckets": list(stats["buckets"])}
+                    for endpoint, stats in request_metrics.items()}
+        slow_queries = slow_query_count
+
+    for endpoint, stats in sorted(snapshot.items()):
+        for (method, status), count in sorted(stats["statuses"].items()):
+            lines.append(f'creativehub_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        "# HELP creativehub_http_request_duration_seconds Wall time per request.",
+        "# TYPE creativehub_http_request_duration_seconds histogram",
+    ]
+    for endpoint, stats in sorted(snapshot.items()):
+        for bound, count in zip(REQUEST_DURATION_BUCKETS, stats["buckets"]):
+            lines.append(f'creativehub_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+        lines.append(f'creativehub_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'creativehub_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["seconds"]:.6f}')
+        lines.append(f'creativehub_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats["count"]}')
+
+    for name, field, kind, help_text in (
+        ("db_seconds_total", "db_seconds", "counter", "Time spent in SQL statements."),
+        ("db_queries_total", "queries", "counter", "SQL statements executed."),
+        ("template_render_seconds_total", "render_seconds", "counter", "Time spent rendering templates."),
+    ):
+        lines += [f"# HELP creativehub_{name} {help_text}", f"# TYPE creativehub_{name} {kind}"]
+        for endpoint, stats in sorted(snapshot.items()):
+            value = stats[field]
+            lines.append(f'creativehub_{name}{{endpoint="{endpoint}"}} {value:.6f}' if isinstance(value, float)
+                         else f'creativehub_{name}{{endpoint="{endpoint}"}} {value}')
+
+    lines += [
+        f"# HELP creativehub_slow_queries_total Statements slower than {SLOW_QUERY_MS:g} ms.",
+        "# TYPE creativehub_slow_queries_total counter",
+        f"creativehub_slow_queries_total {slow_queries}",
+        "# HELP creativehub_db_pool_events_total Connection pool connects, checkouts and invalidations.",
+        "# TYPE creativehub_db_pool_events_total counter",
+    ]
+    status = pool_status()
+    for key in pool_events:
+        lines.append(f'creativehub_db_pool_events_total{{event="{key}"}} {status[key]}')
+    lines += [
+        "# HELP creativehub_db_pool_connections Connection pool occupancy (QueuePool only).",
+        "# TYPE creativehub_db_pool_connections gauge",
+    ]
+    for key in ("size", "checked_out", "checked_in", "overflow"):
+        if key in status:
+            lines.append(f'creativehub_db_pool_connections{{state="{key}"}} {status[key]}')
+    return "\n".join(lines) + "\n"
+
+
+# SQLite stores CURRENT_TIMESTAMP with second precision; bind datetimes in the
+# same format so keyset cursors compare equal to the stored values.
+Timestamp = db.DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,6 +438,8 @@ class User(db.Model):
     active_requests = db.Column(db.Integer, default=0)
     completed_requests_month = db.Column(db.Integer, default=0)
     credits_used_total = db.Column(db.Integer, default=0)
+    counters_month = db.Column(db.String(7), nullable=True)  # YYYY-MM that completed_requests_month counts
+    change_version = db.Column(db.Integer, nullable=True, default=0)  # bumped when requests or credits change
 
 
 class ServiceRequest(db.Model):
@@ -49,144 +449,2644 @@ class ServiceRequest(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(50), default="Pending")  # Pending, In Progress, Completed
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+    completed_at = db.Column(Timestamp, nullable=True)
+    next_transition_at = db.Column(Timestamp, nullable=True)  # when the workflow moves it on; None once closed
 
     user = db.relationship('User', backref='requests')
 
+    __table_args__ = (
+        # status sweep: due requests per status, earliest first
+        db.Index('ix_service_request_status_due', 'status', 'next_transition_at'),
+        # my_requests: all of a user's requests, newest first
+        db.Index('ix_service_request_user_created', 'user_id', 'created_at', 'id'),
+        # status tiles, dashboard counts and the status filter
+        db.Index('ix_service_request_user_status_created', 'user_id', 'status', 'created_at', 'id'),
+    )
+
 class CreditTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     type = db.Column(db.String(50), nullable=False)   # e.g. 'purchase', 'use', 'expiry'
     description = db.Column(db.String(200), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
     expiry_date = db.Column(db.String(50), nullable=True)
 
     user = db.relationship('User', backref='credit_transactions')
 
+    __table_args__ = (
+        # credit_history and the CSV export, newest first
+        db.Index('ix_credit_transaction_user_created', 'user_id', 'created_at', 'id'),
+        # per-type totals such as credits used
+        db.Index('ix_credit_transaction_user_type_created', 'user_id', 'type', 'created_at'),
+    )
+
+
+class CreditLot(db.Model):
+    """Credits from one purchase or grant, spent soonest-expiring first."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('credit_transaction.id'), nullable=True)
+    amount = db.Column(db.Integer, nullable=False)
+    remaining = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(Timestamp, nullable=True)  # None never expires
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    transaction = db.relationship('CreditTransaction')
+
+    __table_args__ = (
+        # spending: a user's lots in expiry order
+        db.Index('ix_credit_lot_user_expires', 'user_id', 'expires_at', 'id'),
+        # archiving: whether a transaction still backs a lot
+        db.Index('ix_credit_lot_transaction', 'transaction_id'),
+        # expiry sweep: only lots that still hold credits
+        db.Index('ix_credit_lot_due', 'expires_at',
+                 sqlite_where=db.text('remaining > 0'), postgresql_where=db.text('remaining > 0')),
+    )
+
+
+class ArchivedServiceRequest(db.Model):
+    """A closed request moved out of service_request by archive_history."""
+    __tablename__ = 'service_request_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # its service_request id
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    service_type = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(Timestamp, nullable=True)
+    completed_at = db.Column(Timestamp, nullable=True)
+    archived_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_service_request_archive_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+
+class ArchivedCreditTransaction(db.Model):
+    """A settled credit transaction moved out of credit_transaction by archive_history."""
+    __tablename__ = 'credit_transaction_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # its credit_transaction id
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.String(200), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(Timestamp, nullable=True)
+    expiry_date = db.Column(db.String(50), nullable=True)
+    archived_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_credit_transaction_archive_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+
+class ArchiveSnapshot(db.Model):
+    """
+    Per-user totals of everything moved to the archive tables, updated in
+    the same transaction as each move: a total is snapshot + hot rows.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_purchased = db.Column(db.Integer, nullable=False, default=0)  # positive amounts
+    total_used = db.Column(db.Integer, nullable=False, default=0)  # negative amounts, stored positive
+    credits_spent = db.Column(db.Integer, nullable=False, default=0)  # 'use' transactions only
+    completed_requests = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_requests = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AttachmentBlob(db.Model):
+    """Stored attachment content, keyed by its SHA-256 and shared by every attachment with those bytes."""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+
+class Attachment(db.Model):
+    """A file on a service request."""
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the request may have moved to service_request_archive
+    request_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    sha256 = db.Column(db.String(64), db.ForeignKey('attachment_blob.sha256'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        # my_requests and the size limit: a request's attachments
+        db.Index('ix_attachment_request', 'request_id'),
+    )
+
+
+class AttachmentUpload(db.Model):
+    """
+    A chunked upload: `received` bytes are in the object store's part file.
+    Kept (with attachment_id set) after it completes, so a client that lost
+    the final response can still find out, until prune_uploads drops it.
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    request_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)  # declared by the client, checked on completion
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    attachment_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+    updated_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        # the size limit: bytes reserved by a request's unfinished uploads
+        db.Index('ix_attachment_upload_request', 'request_id'),
+        # prune_uploads: uploads nobody has touched for a while
+        db.Index('ix_attachment_upload_updated', 'updated_at'),
+    )
+
+
+class IdempotencyKey(db.Model):
+    """A processed form submission; a repeated key means the POST was already handled."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    endpoint = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+        db.Index('ix_idempotency_key_created', 'created_at'),
+    )
+
+
+class DailyRequestStats(db.Model):
+    """Requests created per user, day and service type, counted by their current status."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    service_type = db.Column(db.String(50), primary_key=True)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    in_progress = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
 
 
-# Create database tables if they don't exist
-with app.app_context():
-    db.create_all()
+class DailyCreditStats(db.Model):
+    """Credit movements per user and day, rolled up from credit_transaction."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    purchased = db.Column(db.Integer, nullable=False, default=0)
+    used = db.Column(db.Integer, nullable=False, default=0)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+    granted = db.Column(db.Integer, nullable=False, default=0)  # bonus credits
+    adjusted = db.Column(db.Integer, nullable=False, default=0)  # any other type, signed
+
+
+class RollupWatermark(db.Model):
+    """Highest source row id a batch job has finished with (rollups, ledger reconciliation)."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(Timestamp, nullable=True)
+
+
+class JobLease(db.Model):
+    """Which process runs a periodic job; a lease past expires_at can be taken over."""
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(100), nullable=True)
+    acquired_at = db.Column(Timestamp, nullable=True)
+    expires_at = db.Column(Timestamp, nullable=True)
+
+
+class Notification(db.Model):
+    """Outbox row for a message to send; written in the same transaction as the change it reports."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    channel = db.Column(db.String(20), nullable=False, default='whatsapp')
+    recipient = db.Column(db.String(50), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    dedupe_key = db.Column(db.String(200), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(Timestamp, nullable=False, default=db.func.current_timestamp())
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(Timestamp, default=db.func.current_timestamp())
+    sent_at = db.Column(Timestamp, nullable=True)
+
+    __table_args__ = (
+        # dispatcher: due pending messages, oldest first
+        db.Index('ix_notification_status_due', 'status', 'next_attempt_at'),
+    )
+
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+
+# Ordered schema migrations: (version, name, function taking a Connection).
+# Each one runs in its own transaction and is recorded in schema_migration.
+# Migrations must be safe on a database created from the current models, so
+# they check for existing tables, columns and indexes before changing them.
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def create_index(conn, model, index_name):
+    """Create one of a model's declared indexes if it doesn't exist yet."""
+    index = next(i for i in model.__table__.indexes if i.name == index_name)
+    index.create(conn, checkfirst=True)
+
+
+@migration(1, "initial schema")
+def _initial_schema(conn):
+    for model in (User, ServiceRequest, CreditTransaction):
+        model.__table__.create(conn, checkfirst=True)
+
+
+@migration(2, "composite indexes for hot query shapes")
+def _hot_query_indexes(conn):
+    create_index(conn, ServiceRequest, 'ix_service_request_user_created')
+    create_index(conn, ServiceRequest, 'ix_service_request_user_status_created')
+    create_index(conn, CreditTransaction, 'ix_credit_transaction_user_created')
+    create_index(conn, CreditTransaction, 'ix_credit_transaction_user_type_created')
+
+
+def add_column(conn, model, column_name):
+    """Add one of a model's declared columns to an existing table if it's missing."""
+    table = model.__tablename__
+    if column_name in {c['name'] for c in db.inspect(conn).get_columns(table)}:
+        return
+    column = model.__table__.c[column_name]
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(db.text(
+        f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column.name)} "
+        f"{column.type.compile(dialect=conn.dialect)}"
+    ))
+
+
+@migration(3, "dashboard counters")
+def _dashboard_counters(conn):
+    add_column(conn, User, 'counters_month')
+    add_column(conn, ServiceRequest, 'completed_at')
+    # Completion times weren't recorded before; created_at is the closest we have
+    conn.execute(
+        db.update(ServiceRequest.__table__)
+        .where(ServiceRequest.status == 'Completed', ServiceRequest.completed_at.is_(None))
+        .values(completed_at=ServiceRequest.created_at)
+    )
+    conn.execute(rebuild_counters_statement(include_archive=False))
+
+
+@migration(4, "status sweep index")
+def _status_sweep_index(conn):
+    # Raw DDL: the model no longer declares this index (migration 8 replaces it)
+    conn.execute(db.text(
+        f"CREATE INDEX IF NOT EXISTS ix_service_request_status_created "
+        f"ON {ServiceRequest.__tablename__} (status, created_at)"
+    ))
+
+
+@migration(5, "notification outbox")
+def _notification_outbox(conn):
+    Notification.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, "credit lots")
+def _credit_lots(conn):
+    CreditLot.__table__.create(conn, checkfirst=True)
+    if conn.execute(db.select(db.func.count()).select_from(CreditLot.__table__)).scalar():
+        return
+
+    # Open one lot per user for their current balance, expiring on their old expiry date
+    users = conn.execute(
+        db.select(User.id, User.credits, User.expiry_date).where(User.credits > 0)
+    ).all()
+    lots = [
+        {'user_id': u.id, 'amount': u.credits, 'remaining': u.credits, 'expires_at': lot_expiry(u.expiry_date)}
+        for u in users
+    ]
+    if lots:
+        conn.execute(db.insert(CreditLot.__table__), lots)
+
+
+@migration(7, "idempotency keys")
+def _idempotency_keys(conn):
+    IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+
+@migration(8, "due-time status workflow")
+def _status_workflow(conn):
+    add_column(conn, ServiceRequest, 'next_transition_at')
+
+    # Open requests were due relative to created_at; keep that schedule
+    open_requests = conn.execute(
+        db.select(ServiceRequest.id, ServiceRequest.service_type, ServiceRequest.status, ServiceRequest.created_at)
+        .where(ServiceRequest.status.in_(OPEN_STATUSES), ServiceRequest.next_transition_at.is_(None))
+    ).all()
+    updates = []
+    for row in open_requests:
+        minutes = minutes_until_leaving(row.service_type, row.status)
+        if minutes is not None and row.created_at is not None:
+            updates.append({'row_id': row.id, 'due': row.created_at + timedelta(minutes=minutes)})
+    if updates:
+        table = ServiceRequest.__table__
+        conn.execute(
+            db.update(table).where(table.c.id == db.bindparam('row_id'))
+            .values(next_transition_at=db.bindparam('due')),
+            updates
+        )
+
+    create_index(conn, ServiceRequest, 'ix_service_request_status_due')
+    conn.execute(db.text("DROP INDEX IF EXISTS ix_service_request_status_created"))
+
+
+@migration(9, "job leases")
+def _job_leases(conn):
+    JobLease.__table__.create(conn, checkfirst=True)
+
+
+@migration(10, "daily usage rollups")
+def _daily_rollups(conn):
+    for model in (DailyRequestStats, DailyCreditStats, RollupWatermark):
+        model.__table__.create(conn, checkfirst=True)
+    rebuild_rollups(conn)
+
+
+@migration(11, "user change version")
+def _user_change_version(conn):
+    add_column(conn, User, 'change_version')
+
+
+@migration(12, "full-text search")
+def _full_text_search(conn):
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        # External-content FTS5 index over title and description. The update
+        # trigger only fires for those columns, so status changes skip it.
+        conn.execute(db.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS service_request_fts USING fts5("
+            "title, description, content='service_request', content_rowid='id', "
+            "tokenize='porter unicode61')"
+        ))
+        conn.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS service_request_fts_insert AFTER INSERT ON service_request BEGIN "
+            "INSERT INTO service_request_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            "END"
+        ))
+        conn.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS service_request_fts_delete AFTER DELETE ON service_request BEGIN "
+            "INSERT INTO service_request_fts(service_request_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "END"
+        ))
+        conn.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS service_request_fts_update "
+            "AFTER UPDATE OF title, description ON service_request BEGIN "
+            "INSERT INTO service_request_fts(service_request_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO service_request_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+            "END"
+        ))
+        conn.execute(db.text("INSERT INTO service_request_fts(service_request_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        # A generated column stays in sync on every insert and update by itself
+        conn.execute(db.text(
+            "ALTER TABLE service_request ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+            ") STORED"
+        ))
+        conn.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_service_request_search ON service_request USING GIN (search_vector)"
+        ))
+
+
+@migration(13, "history archive")
+def _history_archive(conn):
+    for model in (ArchivedServiceRequest, ArchivedCreditTransaction, ArchiveSnapshot):
+        model.__table__.create(conn, checkfirst=True)
+    create_index(conn, CreditLot, 'ix_credit_lot_transaction')
+
+
+@migration(14, "attachments")
+def _attachments(conn):
+    for model in (AttachmentBlob, Attachment, AttachmentUpload):
+        model.__table__.create(conn, checkfirst=True)
+
+
+@migration(15, "opening ledger adjustments")
+def _opening_ledger_adjustments(conn):
+    # Balances built up before the ledger was complete: record the difference
+    # (against hot rows plus the archive snapshot) as an opening adjustment,
+    # so reconcile-ledger starts from agreement. Users already in agreement
+    # get nothing, so running it again adds no rows.
+    transactions = CreditTransaction.__table__
+    ledger = db.select(transactions.c.user_id, db.func.sum(transactions.c.amount).label('total')).group_by(
+        transactions.c.user_id
+    ).subquery()
+    difference = (db.func.coalesce(User.credits, 0) - db.func.coalesce(ledger.c.total, 0)
+                  - db.func.coalesce(ArchiveSnapshot.total_purchased, 0)
+                  + db.func.coalesce(ArchiveSnapshot.total_used, 0))
+    conn.execute(db.insert(transactions).from_select(
+        ['user_id', 'type', 'description', 'amount'],
+        db.select(
+            User.id,
+            db.literal('adjustment'),
+            db.literal("Opening balance carried over into the credit ledger"),
+            difference
+        ).select_from(User.__table__)
+        .outerjoin(ledger, ledger.c.user_id == User.id)
+        .outerjoin(ArchiveSnapshot.__table__, ArchiveSnapshot.user_id == User.id)
+        .where(difference != 0)
+    ))
+
+
+def upgrade_db():
+    """Apply pending migrations in order. Returns the names of those applied."""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = {version for (version,) in db.session.query(SchemaMigration.version)}
+    db.session.commit()
+
+    done = []
+    for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        with db.engine.begin() as conn:
+            fn(conn)
+            conn.execute(db.insert(SchemaMigration).values(version=version, name=name))
+        done.append(f"{version}: {name}")
+    return done
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create or upgrade the database schema."""
+    done = upgrade_db()
+    for name in done:
+        print(f"Applied migration {name}")
+    if not done:
+        print("Database schema is up to date.")
+
+def insert_ignoring_conflicts(model, conflict_columns):
+    """INSERT that skips rows clashing with a unique constraint (SQLite and PostgreSQL)."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return db.insert(model)
+    return insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+
+
+def enqueue_notifications(messages):
+    """
+    Add WhatsApp messages to the outbox in the caller's transaction.
+    Each message is a dict with user_id, recipient, body and dedupe_key;
+    messages whose dedupe_key is already queued are skipped.
+    """
+    messages = [m for m in messages if m.get('recipient')]
+    if messages:
+        db.session.execute(insert_ignoring_conflicts(Notification, ['dedupe_key']), messages)
+
 
 # Twilio WhatsApp function
-def send_whatsapp(to_number, message):
+def send_whatsapp(to_number, message, user_id=None, dedupe_key=None):
+    """Queue a WhatsApp message; the dispatcher sends it after the caller commits."""
     if not to_number:
         return
-    try:
-        account_sid = 'YOUR_TWILIO_SID'
-        auth_token = 'YOUR_TWILIO_AUTH_TOKEN'
-        client = Client(account_sid, auth_token)
-        client.messages.create(
-            from_='whatsapp:+14155238886',  # Twilio sandbox number
-            body=message,
+    enqueue_notifications([{
+        'user_id': user_id,
+        'recipient': to_number,
+        'body': message,
+        'dedupe_key': dedupe_key
+    }])
+
+
+class TwilioTransport:
+    """Sends WhatsApp messages through one shared Twilio client and its HTTP session."""
+
+    def __init__(self, account_sid, auth_token, from_number):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # Imported on first send; twilio is slow to import and most
+                    # requests (and every cold start) never need it
+                    from twilio.rest import Client
+                    self._client = Client(self.account_sid, self.auth_token)
+        return self._client
+
+    def send(self, to_number, body):
+        self.client.messages.create(
+            from_=f'whatsapp:{self.from_number}',
+            body=body,
             to=f'whatsapp:{to_number}'
         )
+
+
+class StubTransport:
+    """Records messages instead of sending them, for offline runs and benchmarks."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to_number, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("stub transport failure")
+        with self._lock:
+            self.sent.append((to_number, body))
+
+
+_notification_transport = None
+_notification_executor = None
+
+
+def get_notification_transport():
+    global _notification_transport
+    if _notification_transport is None:
+        if NOTIFY_TRANSPORT == 'stub':
+            _notification_transport = StubTransport()
+        else:
+            _notification_transport = TwilioTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_FROM)
+    return _notification_transport
+
+
+def get_notification_executor():
+    global _notification_executor
+    if _notification_executor is None:
+        _notification_executor = ThreadPoolExecutor(
+            max_workers=NOTIFY_CONCURRENCY, thread_name_prefix='notify'
+        )
+    return _notification_executor
+
+
+def _deliver(transport, notification):
+    try:
+        transport.send(notification.recipient, notification.body)
+        return None
     except Exception as e:
-        print(f"WhatsApp notification failed: {e}")
+        return str(e)[:500] or e.__class__.__name__
 
-def update_request_statuses():
-    with app.app_context():
-        now = datetime.now(timezone.utc)  # timezone-aware current time
-
-        # Fetch pending requests
-        pending_requests = ServiceRequest.query.filter_by(status="Pending").all()
-        for req in pending_requests:
-            # Make created_at timezone-aware if naive
-            created_at = req.created_at
-            if created_at.tzinfo is None:
-                created_at = created_at.replace(tzinfo=timezone.utc)
-
-            if created_at + timedelta(minutes=1) <= now:
-                req.status = "In Progress"
-                send_whatsapp(req.user.whatsapp_number,
-                              f"Your request '{req.title}' is now In Progress.")
-
-        # Fetch in-progress requests
-        inprogress_requests = ServiceRequest.query.filter_by(status="In Progress").all()
-        for req in inprogress_requests:
-            created_at = req.created_at
-            if created_at.tzinfo is None:
-                created_at = created_at.replace(tzinfo=timezone.utc)
-
-            if created_at + timedelta(minutes=10) <= now:
-                req.status = "Completed"
-                send_whatsapp(req.user.whatsapp_number,
-                              f"Your request '{req.title}' has been Completed.")
 
+def dispatch_notifications(batch_size=100, transport=None):
+    """
+    Send one batch of due outbox messages with bounded concurrency.
+    Failures are retried with exponential backoff until NOTIFY_MAX_ATTEMPTS.
+    Returns (sent, failed) for the batch.
+
+    The batch is claimed in a short transaction (next_attempt_at pushed
+    NOTIFY_CLAIM_SECONDS ahead, so other dispatchers pass it over), sent
+    with no transaction or row lock open, and the results recorded in a
+    second short transaction.
+    """
+    transport = transport or get_notification_transport()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # SKIP LOCKED lets several dispatchers share the outbox on PostgreSQL
+    due = db.session.query(
+        Notification.id, Notification.recipient, Notification.body, Notification.attempts
+    ).filter(
+        Notification.status == 'pending',
+        Notification.next_attempt_at <= now
+    ).order_by(Notification.next_attempt_at).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    if not due:
         db.session.commit()
+        return 0, 0
+
+    claimed_until = now + timedelta(seconds=NOTIFY_CLAIM_SECONDS)
+    ids = [n.id for n in due]
+    db.session.execute(
+        db.update(Notification).where(
+            Notification.id.in_(ids),
+            Notification.status == 'pending',
+            Notification.next_attempt_at <= now  # without SKIP LOCKED (SQLite) another dispatcher may claim first
+        ).values(next_attempt_at=claimed_until)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = {notification_id for (notification_id,) in db.session.query(Notification.id).filter(
+        Notification.id.in_(ids), Notification.next_attempt_at == claimed_until
+    )}
+    db.session.commit()
+    due = [n for n in due if n.id in claimed]
+    if not due:
+        return 0, 0
+
+    errors = list(get_notification_executor().map(lambda n: _deliver(transport, n), due))
+
+    delivered, retries = [], []
+    for notification, error in zip(due, errors):
+        if error is None:
+            delivered.append({'notification_id': notification.id})
+            continue
+        attempts = notification.attempts + 1
+        backoff = NOTIFY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        retries.append({
+            'notification_id': notification.id,
+            'new_attempts': attempts,
+            'new_status': 'failed' if attempts >= NOTIFY_MAX_ATTEMPTS else 'pending',
+            'new_next_attempt_at': now + timedelta(seconds=backoff * random.uniform(0.8, 1.2)),
+            'new_error': error
+        })
+
+    # Only rows still under this batch's claim: if it ran past
+    # NOTIFY_CLAIM_SECONDS, the dispatcher that re-claimed them reports instead
+    outbox = Notification.__table__
+    still_claimed = outbox.c.next_attempt_at == claimed_until
+    if delivered:
+        db.session.execute(
+            db.update(outbox).where(outbox.c.id == db.bindparam('notification_id'), still_claimed)
+            .values(status='sent', sent_at=utcnow(), attempts=outbox.c.attempts + 1),
+            delivered
+        )
+    if retries:
+        db.session.execute(
+            db.update(outbox).where(outbox.c.id == db.bindparam('notification_id'), still_claimed).values(
+                status=db.bindparam('new_status'),
+                attempts=db.bindparam('new_attempts'),
+                next_attempt_at=db.bindparam('new_next_attempt_at'),
+                last_error=db.bindparam('new_error')
+            ),
+            retries
+        )
+    db.session.commit()
+    return len(delivered), len(retries)
+
+
+@app.cli.command('dispatch-notifications')
+@click.option('--loop', is_flag=True, help='Keep polling the outbox instead of exiting when it is empty.')
+@click.option('--interval', default=5.0, help='Seconds to sleep between polls when idle.')
+@click.option('--batch-size', default=100)
+def dispatch_notifications_command(loop, interval, batch_size):
+    """Send queued WhatsApp notifications."""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = dispatch_notifications(batch_size=batch_size)
+        total_sent += sent
+        total_failed += failed
+        if sent or failed:
+            continue
+        if not loop:
+            break
+        time.sleep(interval)
+    print(f"Sent {total_sent} notifications, {total_failed} failed attempts.")
+
+
+OPEN_STATUSES = ("Pending", "In Progress")
+CLOSED_STATUSES = ("Completed", "Cancelled")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
-# scheduler = BackgroundScheduler()
-# scheduler.add_job(func=update_request_statuses, trigger="interval", seconds=30)
-# scheduler.start()
 
+def current_month():
+    return datetime.now(timezone.utc).strftime("%Y-%m")
 
-def check_and_expire_credits(user):
+
+def bump_user_counters(user_id, active=0, completed=0, credits_used=0):
     """
-    Checks if the user's credits have expired and deducts them if necessary.
-    Returns True if credits expired, else False.
+    Adjust a user's dashboard counters inside the caller's transaction.
+    Uses a single atomic UPDATE so concurrent writers can't lose increments;
+    completions recorded in a new month restart the monthly count.
     """
-    if not user.expiry_date:
-        return False  # No expiry set
+    values = {}
+    if active:
+        values['active_requests'] = db.func.coalesce(User.active_requests, 0) + active
+    if credits_used:
+        values['credits_used_total'] = db.func.coalesce(User.credits_used_total, 0) + credits_used
+    if completed:
+        month = current_month()
+        values['completed_requests_month'] = db.case(
+            (User.counters_month == month, db.func.coalesce(User.completed_requests_month, 0) + completed),
+            else_=completed
+        )
+        values['counters_month'] = month
+    if values:
+        db.session.execute(
+            db.update(User).where(User.id == user_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        mark_user_changed(user_id)
 
-    try:
-        expiry_date = datetime.strptime(user.expiry_date, "%Y-%m-%d").date()
-    except ValueError:
-        # handle old date formats if any
-        try:
-            expiry_date = datetime.strptime(user.expiry_date, "%m/%d/%Y").date()
-        except ValueError:
-            return False
 
-    today = datetime.now().date()
+def bump_completed_counters(completed_by_user):
+    """
+    Record completions for many users at once, given {user_id: count}.
+    Sent as one executemany instead of an UPDATE per user.
+    """
+    if not completed_by_user:
+        return
+    users = User.__table__
+    month = current_month()
+    db.session.execute(
+        db.update(users).where(users.c.id == db.bindparam('counter_user_id')).values(
+            active_requests=db.func.coalesce(users.c.active_requests, 0) - db.bindparam('counter_completed'),
+            completed_requests_month=db.case(
+                (users.c.counters_month == month,
+                 db.func.coalesce(users.c.completed_requests_month, 0) + db.bindparam('counter_completed')),
+                else_=db.bindparam('counter_completed')
+            ),
+            counters_month=month
+        ),
+        [
+            {'counter_user_id': user_id, 'counter_completed': count}
+            for user_id, count in completed_by_user.items()
+        ]
+    )
+    for user_id in completed_by_user:
+        mark_user_changed(user_id)
 
-    if today > expiry_date and user.credits > 0:
-        expired_amount = user.credits
 
-        # Deduct all remaining credits
-        user.credits = 0
-        user.expiring_credits = 0  # reset
-        db.session.commit()
+def rebuild_counters_statement(user_id=None, include_archive=True):
+    """
+    UPDATE that recomputes the dashboard counters from the source tables and
+    the archive snapshot (include_archive=False before that table exists).
+    """
+    now = datetime.now(timezone.utc)
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    requests_table = ServiceRequest.__table__
+    transactions_table = CreditTransaction.__table__
+    users_table = User.__table__
 
-        # Log this expiry
-        transaction = CreditTransaction(
-            user_id=user.id,
-            type='expiry',
-            description=f"{expired_amount} credits expired on {expiry_date}",
-            amount=-expired_amount,
-            expiry_date=user.expiry_date
+    credits_used = db.select(db.func.coalesce(-db.func.sum(transactions_table.c.amount), 0)).where(
+        transactions_table.c.user_id == users_table.c.id,
+        transactions_table.c.type == 'use'
+    ).scalar_subquery()
+    if include_archive:
+        # Archived requests are closed and older than this month, so only
+        # credits spent needs the snapshot
+        credits_used = credits_used + db.func.coalesce(db.select(ArchiveSnapshot.credits_spent).where(
+            ArchiveSnapshot.user_id == users_table.c.id
+        ).scalar_subquery(), 0)
+
+    statement = db.update(users_table).values(
+        active_requests=db.select(db.func.count(requests_table.c.id)).where(
+            requests_table.c.user_id == users_table.c.id,
+            requests_table.c.status.in_(OPEN_STATUSES)
+        ).scalar_subquery(),
+        completed_requests_month=db.select(db.func.count(requests_table.c.id)).where(
+            requests_table.c.user_id == users_table.c.id,
+            requests_table.c.status == 'Completed',
+            requests_table.c.completed_at >= month_start
+        ).scalar_subquery(),
+        credits_used_total=credits_used,
+        counters_month=now.strftime("%Y-%m")
+    )
+    if user_id is not None:
+        statement = statement.where(users_table.c.id == user_id)
+    return statement
+
+
+@app.cli.command('rollover-counters')
+def rollover_counters_command():
+    """Reset monthly completion counters left over from a previous month."""
+    month = current_month()
+    result = db.session.execute(
+        db.update(User).where(
+            db.or_(User.counters_month.is_(None), User.counters_month != month)
+        ).values(completed_requests_month=0, counters_month=month)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    print(f"Rolled over counters for {result.rowcount} users to {month}.")
+
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Recompute every user's dashboard counters from requests and transactions."""
+    result = db.session.execute(rebuild_counters_statement())
+    db.session.commit()
+    print(f"Rebuilt counters for {result.rowcount} users.")
+
+
+# Daily rollups. Request stats are kept current by the write paths; credit
+# stats are caught up from credit_transaction by roll_up_credit_transactions.
+REQUEST_STATUS_COLUMNS = {
+    "Pending": "pending",
+    "In Progress": "in_progress",
+    "Completed": "completed",
+    "Cancelled": "cancelled",
+}
+CREDIT_TYPE_COLUMNS = {"purchase": "purchased", "use": "used", "expiry": "expired", "bonus": "granted"}
+ROLLUP_BATCH_SIZE = 1000
+# Transactions younger than this are left for the next run, so one that
+# commits after a higher id was rolled up isn't skipped
+ROLLUP_SETTLE_SECONDS = 60
+
+
+def upsert_adding(model, key_columns, rows):
+    """INSERT rows, adding their counts onto any existing row with the same key (SQLite and PostgreSQL)."""
+    if not rows:
+        return
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = model.__table__
+    count_columns = [c.name for c in table.columns if c.name not in key_columns]
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: table.c[name] + statement.excluded[name] for name in count_columns}
+    )
+    db.session.execute(statement, [{**dict.fromkeys(count_columns, 0), **row} for row in rows])
+
+
+def record_status_changes(changes):
+    """
+    Move requests between status counts in daily_request_stats, in the
+    caller's transaction. `changes` is a list of (user_id, created_at,
+    service_type, old status or None for a new request, new status).
+    """
+    rows = {}
+    for user_id, created_at, service_type, old_status, new_status in changes:
+        key = (user_id, created_at.date(), service_type)
+        row = rows.setdefault(key, {'user_id': key[0], 'day': key[1], 'service_type': key[2]})
+        if old_status:
+            column = REQUEST_STATUS_COLUMNS[old_status]
+            row[column] = row.get(column, 0) - 1
+        column = REQUEST_STATUS_COLUMNS[new_status]
+        row[column] = row.get(column, 0) + 1
+    upsert_adding(DailyRequestStats, ['user_id', 'day', 'service_type'], list(rows.values()))
+
+
+def credit_stats_row(transaction_type, amount):
+    column = CREDIT_TYPE_COLUMNS.get(transaction_type, 'adjusted')
+    # used and expired are stored as positive amounts
+    return column, -amount if column in ('used', 'expired') else amount
+
+
+def roll_up_credit_transactions(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Fold credit transactions past the watermark into daily_credit_stats, one
+    batch per transaction: the stats and the new watermark commit together,
+    so a crash never counts a transaction twice. Returns the number rolled up.
+    """
+    db.session.execute(insert_ignoring_conflicts(RollupWatermark, ['name']), [{'name': 'credit_transaction', 'last_id': 0}])
+    db.session.commit()
+    total = 0
+    while True:
+        last_id = db.session.get(RollupWatermark, 'credit_transaction', populate_existing=True).last_id
+        settled = utcnow() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)
+        batch = db.session.execute(
+            db.select(CreditTransaction.id, CreditTransaction.user_id, CreditTransaction.type,
+                      CreditTransaction.amount, CreditTransaction.created_at)
+            .where(CreditTransaction.id > last_id)
+            .order_by(CreditTransaction.id).limit(batch_size)
+        ).all()
+        settled_rows = []
+        for row in batch:
+            if row.created_at is not None and row.created_at > settled:
+                break
+            settled_rows.append(row)
+        if not settled_rows:
+            db.session.rollback()
+            return total
+
+        rows = {}
+        for row in settled_rows:
+            day = (row.created_at or settled).date()
+            stats = rows.setdefault((row.user_id, day), {'user_id': row.user_id, 'day': day})
+            column, amount = credit_stats_row(row.type, row.amount)
+            stats[column] = stats.get(column, 0) + amount
+        upsert_adding(DailyCreditStats, ['user_id', 'day'], list(rows.values()))
+
+        moved = db.session.execute(
+            db.update(RollupWatermark).where(
+                RollupWatermark.name == 'credit_transaction',
+                RollupWatermark.last_id == last_id
+            ).values(last_id=settled_rows[-1].id, updated_at=utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if moved.rowcount != 1:
+            # Another run advanced the watermark first; its batch wins
+            db.session.rollback()
+            return total
+        check_job_lock()
+        db.session.commit()
+        total += len(settled_rows)
+        if len(settled_rows) < batch_size:
+            return total
+
+
+def with_archive(conn, model, archive_model):
+    """
+    A model's table plus its archive table's rows, as one selectable for
+    full-history queries. Just the table while the archive isn't migrated yet.
+    """
+    table = model.__table__
+    if not db.inspect(conn).has_table(archive_model.__tablename__):
+        return table
+    names = [c.name for c in archive_model.__table__.columns if c.name != 'archived_at']
+    return db.union_all(
+        db.select(*[table.c[name] for name in names]),
+        db.select(*[archive_model.__table__.c[name] for name in names])
+    ).subquery()
+
+
+def rebuild_rollups(conn):
+    """Recompute both rollup tables from the source and archive tables on `conn`."""
+    requests_table = with_archive(conn, ServiceRequest, ArchivedServiceRequest)
+    transactions_table = with_archive(conn, CreditTransaction, ArchivedCreditTransaction)
+    request_day = db.func.date(requests_table.c.created_at)
+    transaction_day = db.func.date(transactions_table.c.created_at)
+
+    conn.execute(db.delete(DailyRequestStats.__table__))
+    conn.execute(db.insert(DailyRequestStats.__table__).from_select(
+        ['user_id', 'day', 'service_type', 'pending', 'in_progress', 'completed', 'cancelled'],
+        db.select(
+            requests_table.c.user_id, request_day, requests_table.c.service_type,
+            *[
+                db.func.sum(db.case((requests_table.c.status == status, 1), else_=0))
+                for status in REQUEST_STATUS_COLUMNS
+            ]
+        ).where(requests_table.c.created_at.isnot(None))
+        .group_by(requests_table.c.user_id, request_day, requests_table.c.service_type)
+    ))
+
+    settled = utcnow() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)
+    last_id = conn.execute(
+        db.select(db.func.coalesce(db.func.max(transactions_table.c.id), 0))
+        .where(transactions_table.c.created_at <= settled)
+    ).scalar()
+    def typed(types):
+        return db.func.coalesce(db.func.sum(db.case(
+            (transactions_table.c.type.in_(types), transactions_table.c.amount), else_=0
+        )), 0)
+
+    conn.execute(db.delete(DailyCreditStats.__table__))
+    conn.execute(db.insert(DailyCreditStats.__table__).from_select(
+        ['user_id', 'day', 'purchased', 'used', 'expired', 'granted', 'adjusted'],
+        db.select(
+            transactions_table.c.user_id, transaction_day,
+            typed(['purchase']), -typed(['use']), -typed(['expiry']), typed(['bonus']),
+            db.func.coalesce(db.func.sum(db.case(
+                (transactions_table.c.type.notin_(list(CREDIT_TYPE_COLUMNS)), transactions_table.c.amount),
+                else_=0
+            )), 0)
+        ).where(transactions_table.c.id <= last_id, transactions_table.c.created_at.isnot(None))
+        .group_by(transactions_table.c.user_id, transaction_day)
+    ))
+    conn.execute(db.delete(RollupWatermark.__table__).where(RollupWatermark.name == 'credit_transaction'))
+    conn.execute(db.insert(RollupWatermark.__table__).values(name='credit_transaction', last_id=last_id))
+
+
+@app.cli.command('roll-up-credits')
+def roll_up_credits_command():
+    """Fold new credit transactions into the daily credit rollup."""
+    print(f"Rolled up {roll_up_credit_transactions()} credit transactions.")
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the daily request and credit rollups from scratch."""
+    # Under the roll-up job's lock, so a scheduled roll-up can't add to the rebuilt totals
+    with job_lock('roll-up-credits') as locked:
+        if not locked:
+            raise SystemExit("A credit roll-up is running; try again when it has finished.")
+        with db.engine.begin() as conn:
+            rebuild_rollups(conn)
+            check_job_lock()
+    print("Rebuilt daily rollups.")
+
+
+STATUS_SWEEP_CHUNK_SIZE = 200
+STATUS_WORKER_MAX_SLEEP = 30  # seconds; also bounds how late a brand-new request is picked up
+
+# Request workflow: status -> (next status, minutes spent in this status).
+# Services listed in SERVICE_WORKFLOWS override the default, e.g.
+#   "social": {"Pending": ("In Progress", 1), "In Progress": ("Completed", 4)},
+DEFAULT_WORKFLOW = {
+    "Pending": ("In Progress", 1),
+    "In Progress": ("Completed", 9),
+}
+SERVICE_WORKFLOWS = {}
+
+STATUS_MESSAGES = {
+    "In Progress": "Your request '{title}' is now In Progress.",
+    "Completed": "Your request '{title}' has been Completed.",
+}
+
+
+def workflow_for(service_type):
+    return SERVICE_WORKFLOWS.get(service_type, DEFAULT_WORKFLOW)
+
+
+def next_transition_time(service_type, status, since):
+    """When a request entering `status` at `since` is due to move on, or None if it stays."""
+    step = workflow_for(service_type).get(status)
+    return since + timedelta(minutes=step[1]) if step else None
+
+
+def minutes_until_leaving(service_type, status):
+    """Minutes from creation until a request leaves `status`, following the workflow from Pending."""
+    workflow, current, total = workflow_for(service_type), "Pending", 0
+    while current in workflow:
+        next_status, minutes = workflow[current]
+        total += minutes
+        if current == status:
+            return total
+        current = next_status
+    return None
+
+
+def workflow_steps():
+    """
+    Yield (service types, status, next status, minutes in the next status) for
+    every transition. Service types is None for the default workflow, which
+    covers every service without its own entry.
+    """
+    for services, workflow in [((svc,), wf) for svc, wf in SERVICE_WORKFLOWS.items()] + [(None, DEFAULT_WORKFLOW)]:
+        for status, (next_status, _) in workflow.items():
+            following = workflow.get(next_status)
+            yield services, status, next_status, following[1] if following else None
+
+
+def transition_due_requests(services, from_status, to_status, next_minutes, now, limit, user_range=None):
+    """
+    Move up to `limit` requests in `from_status` whose next_transition_at has
+    passed to the next status in a single UPDATE ... RETURNING, scheduling
+    their following transition. Only due rows are read, through
+    ix_service_request_status_due. Re-checking the status in the outer WHERE
+    keeps a concurrent cancel from being overwritten.
+    """
+    due_ids = db.select(ServiceRequest.id).where(
+        ServiceRequest.status == from_status,
+        ServiceRequest.next_transition_at <= now
+    )
+    if services:
+        due_ids = due_ids.where(ServiceRequest.service_type.in_(services))
+    elif SERVICE_WORKFLOWS:
+        due_ids = due_ids.where(ServiceRequest.service_type.notin_(list(SERVICE_WORKFLOWS)))
+    if user_range:
+        due_ids = due_ids.where(ServiceRequest.user_id.between(*user_range))
+    due_ids = due_ids.order_by(ServiceRequest.next_transition_at).limit(limit)
+
+    values = {
+        'status': to_status,
+        'next_transition_at': now + timedelta(minutes=next_minutes) if next_minutes is not None else None,
+    }
+    if to_status == 'Completed':
+        values['completed_at'] = now
+
+    return db.session.execute(
+        db.update(ServiceRequest).where(
+            ServiceRequest.id.in_(due_ids),
+            ServiceRequest.status == from_status
+        ).values(**values).returning(
+            ServiceRequest.id, ServiceRequest.user_id, ServiceRequest.title,
+            ServiceRequest.service_type, ServiceRequest.created_at
+        ).execution_options(synchronize_session=False)
+    ).all()
+
+
+def notify_transitioned(rows, to_status, message):
+    """Queue one WhatsApp message per transitioned request, looking numbers up in one query."""
+    user_ids = {row.user_id for row in rows}
+    numbers = dict(
+        db.session.query(User.id, User.whatsapp_number).filter(
+            User.id.in_(user_ids),
+            User.whatsapp_number.isnot(None)
+        ).all()
+    )
+    enqueue_notifications([
+        {
+            'user_id': row.user_id,
+            'recipient': numbers.get(row.user_id),
+            'body': message.format(title=row.title),
+            'dedupe_key': f"request:{row.id}:{to_status}"
+        }
+        for row in rows
+    ])
+
+
+def user_id_range(shard, shards):
+    """Inclusive user_id bounds of one of `shards` equal slices of the current id space."""
+    max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+    size = max(1, -(-max_id // shards))
+    low = shard * size + 1
+    # The last shard is open-ended so users who sign up mid-sweep are covered
+    high = (shard + 1) * size if shard < shards - 1 else 2 ** 31 - 1
+    return low, high
+
+
+def update_request_statuses(chunk_size=STATUS_SWEEP_CHUNK_SIZE, shard=None):
+    """
+    Advance due requests in chunks. Each chunk is one UPDATE, one counter
+    update and one outbox insert committed together, so a batch queues at
+    most `chunk_size` notifications and never reports an uncommitted change.
+    `shard` is (index, count) to handle only that slice of user ids.
+    """
+    with app.app_context():
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # timestamps are stored as naive UTC
+        user_range = user_id_range(*shard) if shard else None
+
+        for services, from_status, to_status, next_minutes in workflow_steps():
+            while True:
+                rows = transition_due_requests(
+                    services, from_status, to_status, next_minutes, now, chunk_size, user_range
+                )
+                if rows and to_status in STATUS_MESSAGES:
+                    notify_transitioned(rows, to_status, STATUS_MESSAGES[to_status])
+                record_status_changes([
+                    (row.user_id, row.created_at, row.service_type, from_status, to_status)
+                    for row in rows if row.created_at is not None
+                ])
+                for row in rows:
+                    mark_user_changed(row.user_id)
+                if to_status == 'Completed':
+                    completed_by_user = {}
+                    for row in rows:
+                        completed_by_user[row.user_id] = completed_by_user.get(row.user_id, 0) + 1
+                    bump_completed_counters(completed_by_user)
+                check_job_lock()
+                db.session.commit()
+
+                if len(rows) < chunk_size:
+                    break
+
+
+def seconds_until_next_transition(max_sleep=STATUS_WORKER_MAX_SLEEP):
+    """How long the worker can sleep before the earliest open request is due."""
+    earliest = [
+        db.session.query(ServiceRequest.next_transition_at)
+        .filter(ServiceRequest.status == status, ServiceRequest.next_transition_at.isnot(None))
+        .order_by(ServiceRequest.next_transition_at).limit(1).scalar()
+        for status in OPEN_STATUSES
+    ]
+    db.session.rollback()
+    earliest = [due for due in earliest if due is not None]
+    if not earliest:
+        return max_sleep
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return min(max_sleep, max(0.0, (min(earliest) - now).total_seconds()))
+
+
+@app.cli.command('run-status-worker')
+@click.option('--once', is_flag=True, help='Advance due requests once and exit.')
+@click.option('--max-sleep', default=STATUS_WORKER_MAX_SLEEP, show_default=True, type=float,
+              help='Longest sleep between sweeps, in seconds.')
+def run_status_worker_command(once, max_sleep):
+    """Advance due requests, then sleep until the next one is due."""
+    while True:
+        run_exclusive('update-request-statuses', update_request_statuses)
+        if once:
+            return
+        time.sleep(seconds_until_next_transition(max_sleep))
+
+
+CREDIT_VALIDITY_DAYS = 365
+EXPIRY_SWEEP_BATCH_SIZE = 500
+
+
+def parse_expiry_date(value):
+    """Parse an expiry date string as stored on users and transactions."""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d", "%m/%d/%Y"):  # handle old date formats if any
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def lot_expiry(expiry_date):
+    """Credits stay usable through their expiry date, so a lot expires at the following midnight."""
+    if isinstance(expiry_date, str):
+        expiry_date = parse_expiry_date(expiry_date)
+    if expiry_date is None:
+        return None
+    return datetime.combine(expiry_date + timedelta(days=1), datetime.min.time())
+
+
+def add_credit_lot(user_id, amount, expiry_date, transaction=None):
+    """Add a lot of `amount` credits usable through `expiry_date` (a YYYY-MM-DD string)."""
+    db.session.add(CreditLot(
+        user_id=user_id,
+        transaction=transaction,
+        amount=amount,
+        remaining=amount,
+        expires_at=lot_expiry(expiry_date)
+    ))
+
+
+def consume_credit_lots(user_id, amount):
+    """
+    Take `amount` credits from a user's unexpired lots, soonest-expiring
+    first. Each lot is decremented with a conditional UPDATE, and lots changed by a
+    concurrent writer are re-read. Returns the amount that couldn't be covered.
+    """
+    now = utcnow()
+    while amount > 0:
+        lots = db.session.query(CreditLot.id, CreditLot.remaining).filter(
+            CreditLot.user_id == user_id,
+            CreditLot.remaining > 0,
+            db.or_(CreditLot.expires_at.is_(None), CreditLot.expires_at > now)
+        ).order_by(db.nulls_last(CreditLot.expires_at.asc()), CreditLot.id).limit(10).all()
+        if not lots:
+            break
+
+        for lot in lots:
+            take = min(lot.remaining, amount)
+            result = db.session.execute(
+                db.update(CreditLot).where(
+                    CreditLot.id == lot.id,
+                    CreditLot.remaining >= take
+                ).values(remaining=CreditLot.remaining - take)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                amount -= take
+                if amount == 0:
+                    break
+    return amount
+
+
+def spend_credits(user_id, amount):
+    """
+    Deduct credits in the caller's transaction. Returns False, without
+    changing anything, if the balance is too low.
+
+    The user's own lots that are past expiry but not yet swept are expired
+    first, so the balance check never counts them. Lots are taken before
+    the balance is checked so every writer locks lots before the user row,
+    the same order as the expiry sweep.
+    """
+    if amount <= 0:
+        return True
+    expire_user_credit_lots(user_id)
+    shortfall = consume_credit_lots(user_id, amount)
+
+    result = db.session.execute(
+        db.update(User).where(
+            User.id == user_id,
+            User.credits >= amount
+        ).values(credits=User.credits - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        return False
+    if shortfall:
+        app.logger.warning("Credit lots for user %s are %s short of their balance", user_id, shortfall)
+    mark_user_changed(user_id)
+    return True
+
+
+def add_credits(user_id, amount):
+    """Add credits to a user's balance with an atomic increment."""
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(credits=User.credits + amount)
+        .execution_options(synchronize_session=False)
+    )
+    mark_user_changed(user_id)
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def claim_idempotency_key(user_id, endpoint):
+    """
+    Record the submission's idempotency key in the current transaction.
+    Returns False if the same key was already processed for this user.
+    Submissions without a key are always processed.
+    """
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not key:
+        return True
+    db.session.add(IdempotencyKey(user_id=user_id, key=key[:64], endpoint=endpoint))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+@app.cli.command('prune-idempotency-keys')
+@click.option('--days', default=7, help='Keep keys newer than this many days.')
+def prune_idempotency_keys_command(days):
+    """Delete idempotency keys old enough that their forms can't be resubmitted."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    result = db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    db.session.commit()
+    print(f"Deleted {result.rowcount} idempotency keys.")
+
+
+def refresh_expiry_summary(user_id):
+    """Store the next expiry date and how many credits expire then, for the dashboard alert."""
+    db.session.flush()
+    lots = db.session.query(CreditLot.expires_at, CreditLot.remaining).filter(
+        CreditLot.user_id == user_id,
+        CreditLot.remaining > 0,
+        CreditLot.expires_at.isnot(None)
+    ).order_by(CreditLot.expires_at).all()
+
+    expiry_date, expiring = None, 0
+    if lots:
+        # expires_at is the midnight after the last usable day
+        next_expiry = lots[0].expires_at
+        expiry_date = (next_expiry - timedelta(days=1)).strftime("%Y-%m-%d")
+        expiring = sum(lot.remaining for lot in lots if lot.expires_at == next_expiry)
+
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(expiry_date=expiry_date, expiring_credits=expiring)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def expire_lots(due):
+    """
+    Zero the given due lots (rows of id, user_id, remaining, expires_at,
+    already locked by the caller), log each one as its own 'expiry'
+    transaction and reduce balances by exactly what expired. Returns the
+    credits expired per user; the caller commits.
+    """
+    db.session.execute(
+        db.update(CreditLot).where(CreditLot.id.in_([lot.id for lot in due]))
+        .values(remaining=0)
+        .execution_options(synchronize_session=False)
+    )
+
+    expired_by_user = {}
+    for lot in due:
+        expired_by_user[lot.user_id] = expired_by_user.get(lot.user_id, 0) + lot.remaining
+
+    users = User.__table__
+    db.session.execute(
+        db.update(users).where(users.c.id == db.bindparam('expired_user_id'))
+        .values(credits=users.c.credits - db.bindparam('expired_amount')),
+        [{'expired_user_id': u, 'expired_amount': n} for u, n in expired_by_user.items()]
+    )
+    db.session.execute(db.insert(CreditTransaction), [
+        {
+            'user_id': lot.user_id,
+            'type': 'expiry',
+            'description': f"{lot.remaining} credits expired on {(lot.expires_at - timedelta(days=1)).date()}",
+            'amount': -lot.remaining,
+            'expiry_date': (lot.expires_at - timedelta(days=1)).strftime("%Y-%m-%d")
+        }
+        for lot in due
+    ])
+    for user_id in expired_by_user:
+        refresh_expiry_summary(user_id)
+        mark_user_changed(user_id)
+    return expired_by_user
+
+
+def expire_user_credit_lots(user_id):
+    """
+    Expire one user's due lots in the caller's transaction, so spending
+    doesn't depend on the sweep having run. Returns the credits expired.
+    """
+    due = db.session.query(
+        CreditLot.id, CreditLot.user_id, CreditLot.remaining, CreditLot.expires_at
+    ).filter(
+        CreditLot.user_id == user_id,
+        CreditLot.expires_at <= utcnow(),
+        CreditLot.remaining > 0
+    ).order_by(CreditLot.expires_at).with_for_update().all()
+    if not due:
+        return 0
+    return sum(expire_lots(due).values())
+
+
+def expire_credit_lots(batch_size=EXPIRY_SWEEP_BATCH_SIZE):
+    """
+    Expire lots whose expiry has passed, one batch per transaction. Only due
+    lots are read (through ix_credit_lot_due); see expire_lots.
+    Returns the number of credits expired.
+    """
+    total = 0
+    while True:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        due = db.session.query(
+            CreditLot.id, CreditLot.user_id, CreditLot.remaining, CreditLot.expires_at
+        ).filter(
+            CreditLot.expires_at <= now,
+            CreditLot.remaining > 0
+        ).order_by(CreditLot.expires_at).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not due:
+            db.session.commit()
+            return total
+
+        expired_by_user = expire_lots(due)
+        check_job_lock()
+        db.session.commit()
+        total += sum(expired_by_user.values())
+
+
+@app.cli.command('expire-credits')
+def expire_credits_command():
+    """Expire credit lots that are past their expiry date."""
+    print(f"Expired {expire_credit_lots()} credits.")
+
+
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def archive_cutoff():
+    """Rows older than this can be archived; never this month's, which the dashboard counters count."""
+    now = utcnow()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return min(now - timedelta(days=ARCHIVE_AFTER_DAYS), month_start)
+
+
+def move_to_archive(model, archive_model, ids):
+    """Copy rows to the archive table and delete them, in the caller's transaction."""
+    table, archive = model.__table__, archive_model.__table__
+    names = [c.name for c in archive.columns if c.name != 'archived_at']
+    db.session.execute(db.insert(archive).from_select(
+        names, db.select(*[table.c[name] for name in names]).where(table.c.id.in_(ids))
+    ))
+    return db.session.execute(db.delete(table).where(table.c.id.in_(ids))).rowcount
+
+
+def archive_history(batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move closed requests and settled credit transactions older than the
+    cutoff to the archive tables, one batch per transaction. Each batch adds
+    what it moved to the users' ArchiveSnapshot rows, so totals computed as
+    snapshot + hot rows don't change. A transaction is settled once it is in
+    the daily rollup and no longer backs a lot with credits left (its spent
+    lots are deleted with it). Returns (requests, transactions) archived.
+    """
+    cutoff = archive_cutoff()
+    archived_requests = archived_transactions = 0
+
+    while True:
+        batch = db.session.query(ServiceRequest.id, ServiceRequest.user_id, ServiceRequest.status).filter(
+            ServiceRequest.status.in_(CLOSED_STATUSES),
+            ServiceRequest.created_at < cutoff,
+            db.func.coalesce(ServiceRequest.completed_at, ServiceRequest.created_at) < cutoff
+        ).order_by(ServiceRequest.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not batch:
+            db.session.commit()
+            break
+
+        snapshots = {}
+        for row in batch:
+            snapshot = snapshots.setdefault(row.user_id, {'user_id': row.user_id})
+            column = 'completed_requests' if row.status == 'Completed' else 'cancelled_requests'
+            snapshot[column] = snapshot.get(column, 0) + 1
+        if move_to_archive(ServiceRequest, ArchivedServiceRequest, [row.id for row in batch]) != len(batch):
+            db.session.rollback()  # another run got some of them first
+            break
+        upsert_adding(ArchiveSnapshot, ['user_id'], list(snapshots.values()))
+        check_job_lock()
+        db.session.commit()
+        archived_requests += len(batch)
+
+    while True:
+        watermark = db.session.get(RollupWatermark, 'credit_transaction', populate_existing=True)
+        backs_a_lot = db.exists().where(CreditLot.transaction_id == CreditTransaction.id, CreditLot.remaining > 0)
+        batch = db.session.query(
+            CreditTransaction.id, CreditTransaction.user_id, CreditTransaction.type, CreditTransaction.amount
+        ).filter(
+            CreditTransaction.created_at < cutoff,
+            CreditTransaction.id <= (watermark.last_id if watermark else 0),
+            ~backs_a_lot
+        ).order_by(CreditTransaction.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not batch:
+            db.session.commit()
+            break
+
+        snapshots = {}
+        for row in batch:
+            snapshot = snapshots.setdefault(row.user_id, {'user_id': row.user_id})
+            if row.amount > 0:
+                snapshot['total_purchased'] = snapshot.get('total_purchased', 0) + row.amount
+            else:
+                snapshot['total_used'] = snapshot.get('total_used', 0) - row.amount
+            if row.type == 'use':
+                snapshot['credits_spent'] = snapshot.get('credits_spent', 0) - row.amount
+        ids = [row.id for row in batch]
+        db.session.execute(db.delete(CreditLot).where(CreditLot.transaction_id.in_(ids)))
+        if move_to_archive(CreditTransaction, ArchivedCreditTransaction, ids) != len(batch):
+            db.session.rollback()
+            break
+        upsert_adding(ArchiveSnapshot, ['user_id'], list(snapshots.values()))
+        check_job_lock()
+        db.session.commit()
+        archived_transactions += len(batch)
+
+    return archived_requests, archived_transactions
+
+
+@app.cli.command('archive-history')
+def archive_history_command():
+    """Move old closed requests and settled credit transactions to the archive tables."""
+    requests_moved, transactions_moved = archive_history()
+    print(f"Archived {requests_moved} requests and {transactions_moved} credit transactions.")
+
+
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def ledger_balances(low, high):
+    """
+    Balance, ledger sum (hot transactions plus the archive snapshot) and
+    credit lot total for each user with low <= id < high, in one statement.
+    """
+    ledger = db.select(CreditTransaction.user_id, db.func.sum(CreditTransaction.amount).label('total')).where(
+        CreditTransaction.user_id >= low, CreditTransaction.user_id < high
+    ).group_by(CreditTransaction.user_id).subquery()
+    lots = db.select(CreditLot.user_id, db.func.sum(CreditLot.remaining).label('total')).where(
+        CreditLot.user_id >= low, CreditLot.user_id < high
+    ).group_by(CreditLot.user_id).subquery()
+    return db.session.execute(
+        db.select(
+            User.id.label('user_id'),
+            db.func.coalesce(User.credits, 0).label('balance'),
+            (db.func.coalesce(ledger.c.total, 0) + db.func.coalesce(ArchiveSnapshot.total_purchased, 0)
+             - db.func.coalesce(ArchiveSnapshot.total_used, 0)).label('ledger'),
+            db.func.coalesce(lots.c.total, 0).label('lots')
+        ).outerjoin(ledger, ledger.c.user_id == User.id)
+        .outerjoin(lots, lots.c.user_id == User.id)
+        .outerjoin(ArchiveSnapshot, ArchiveSnapshot.user_id == User.id)
+        .where(User.id >= low, User.id < high)
+        .order_by(User.id)
+    ).all()
+
+
+def repair_ledger(user_id):
+    """
+    Bring a user's ledger and credit lots in line with their balance, which
+    is what they have been shown and can spend: the difference is recorded
+    as an 'adjustment' transaction, and lots are topped up or drawn down.
+    Rechecked with the user row locked, so a concurrent purchase isn't
+    mistaken for drift. Returns True if anything changed.
+    """
+    db.session.query(User.id).filter(User.id == user_id).with_for_update().one()
+    row = ledger_balances(user_id, user_id + 1)[0]
+    transaction = None
+    if row.ledger != row.balance:
+        transaction = CreditTransaction(
+            user_id=user_id,
+            type='adjustment',
+            description="Balance correction from ledger reconciliation",
+            amount=row.balance - row.ledger
         )
         db.session.add(transaction)
+    if row.lots < row.balance:
+        add_credit_lot(user_id, row.balance - row.lots, None, transaction=transaction)
+    elif row.lots > row.balance:
+        consume_credit_lots(user_id, row.lots - row.balance)
+    changed = transaction is not None or row.lots != row.balance
+    if changed:
+        mark_user_changed(user_id)
+    db.session.commit()
+    return changed
+
+
+def reconcile_users(low, high, repair=False):
+    """
+    Compare balances with the ledger and lots for users with low <= id < high.
+    Returns (users checked, [(user_id, balance, ledger, lots)] that disagreed).
+    """
+    rows = ledger_balances(low, high)
+    db.session.rollback()
+    drift = [tuple(row) for row in rows if row.ledger != row.balance or row.lots != row.balance]
+    if repair:
+        for user_id, *_ in drift:
+            repair_ledger(user_id)
+    return len(rows), drift
+
+
+def _reconcile_worker_init():
+    # Connections inherited from the parent process can't be shared with it
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def _reconcile_chunk(low, high, repair):
+    with app.app_context():
+        return reconcile_users(low, high, repair)
+
+
+def reconcile_ledger(workers=None, chunk_size=RECONCILE_CHUNK_SIZE, repair=False, resume=False, report=None):
+    """
+    Reconcile every user's balance against their ledger, in user id ranges
+    spread over a process pool. Results come back in range order, and after
+    each range the 'reconcile-ledger' watermark records the id every user
+    below has been checked up to, so a resumed run starts from there.
+    `report` is called with each drifting (user_id, balance, ledger, lots).
+    Returns (users checked, users drifting).
+    """
+    low, high = db.session.query(db.func.min(User.id), db.func.max(User.id)).one()
+    db.session.execute(insert_ignoring_conflicts(RollupWatermark, ['name']), [{'name': 'reconcile-ledger', 'last_id': 0}])
+    checkpoint = db.session.get(RollupWatermark, 'reconcile-ledger')
+    db.session.commit()
+    if low is None:
+        return 0, 0
+    start = max(low, checkpoint.last_id) if resume else low
+    starts = list(range(start, high + 1, chunk_size))
+    ends = [min(s + chunk_size, high + 1) for s in starts]
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers, initializer=_reconcile_worker_init) if workers > 1 else None
+    results = (executor.map(_reconcile_chunk, starts, ends, [repair] * len(starts)) if executor
+               else map(reconcile_users, starts, ends, [repair] * len(starts)))
+
+    checked = drifted = 0
+    try:
+        for end, (count, drift) in zip(ends, results):
+            checked += count
+            drifted += len(drift)
+            if report:
+                for row in drift:
+                    report(row)
+            check_job_lock()
+            db.session.execute(
+                db.update(RollupWatermark).where(RollupWatermark.name == 'reconcile-ledger')
+                .values(last_id=end, updated_at=utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return checked, drifted
+
+
+@app.cli.command('reconcile-ledger')
+@click.option('--workers', type=int, default=None, help='Processes to use (default: one per CPU; 1 runs inline).')
+@click.option('--chunk-size', default=RECONCILE_CHUNK_SIZE, show_default=True, help='User ids per chunk.')
+@click.option('--repair', is_flag=True, help='Record adjustments so each ledger matches its balance.')
+@click.option('--resume', is_flag=True, help='Continue from the last checkpoint instead of the first user.')
+def reconcile_ledger_command(workers, chunk_size, repair, resume):
+    """Check every balance against its credit ledger and lots; exits 1 on unrepaired drift."""
+    def report(row):
+        user_id, balance, ledger, lots = row
+        print(f"user {user_id}: balance {balance}, ledger {ledger} ({balance - ledger:+}), "
+              f"lots {lots} ({balance - lots:+}){' - repaired' if repair else ''}")
+
+    started = time.monotonic()
+    with job_lock('reconcile-ledger') as locked:
+        if not locked:
+            raise SystemExit("reconcile-ledger is already running in another process.")
+        checked, drifted = reconcile_ledger(workers, chunk_size, repair, resume, report)
+    print(f"Checked {checked} users in {time.monotonic() - started:.1f}s; {drifted} drifted"
+          f"{', repaired' if repair and drifted else ''}.")
+    if drifted and not repair:
+        raise SystemExit(1)
+
+
+# Total attachment size allowed on one request, by the user's credit
+# balance: (minimum credits, MB). Unfinished uploads count towards it.
+ATTACHMENT_LIMITS_MB = ((0, 25), (100, 100), (500, 500))
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_PRUNE_BATCH_SIZE = 500
+
+
+class LocalObjectStore:
+    """
+    Attachment bytes as files under `root`: chunks/<upload id>/<start>-<end>
+    while an upload is in progress, blobs/<sha256[:2]>/<sha256> once it is
+    complete. Chunk files are only ever created whole (written aside, then
+    renamed), so a late duplicate of a chunk can't damage bytes another
+    request already wrote. Another backend only needs the same methods.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _chunk_dir(self, upload_id):
+        return os.path.join(self.root, 'chunks', upload_id)
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def write_part(self, upload_id, offset, length, chunks):
+        """
+        Store the chunk at offset, durably; returns the bytes written. A
+        chunk that comes up short of length is dropped.
+        """
+        directory = self._chunk_dir(upload_id)
+        os.makedirs(directory, exist_ok=True)
+        temp = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        written = 0
+        with open(temp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if written == length:
+            os.replace(temp, os.path.join(directory, f"{offset}-{offset + length}"))
+        else:
+            os.remove(temp)
+        return written
+
+    def _chunk_chain(self, upload_id, size):
+        """
+        Chunk files covering bytes 0..size in order, or None. Every file
+        holds the range its name says, so any chain that reaches size will
+        do; one is found depth-first, skipping ranges that lead nowhere.
+        """
+        try:
+            names = os.listdir(self._chunk_dir(upload_id))
+        except FileNotFoundError:
+            return None
+        by_start = {}
+        for name in names:
+            start, sep, end = name.partition('-')
+            if sep and start.isdigit() and end.isdigit():
+                by_start.setdefault(int(start), []).append(int(end))
+
+        stack, visited = [(0, [])], set()
+        while stack:
+            offset, chain = stack.pop()
+            if offset == size:
+                return [os.path.join(self._chunk_dir(upload_id), f"{s}-{e}") for s, e in chain]
+            if offset in visited:
+                continue
+            visited.add(offset)
+            for end in sorted(by_start.get(offset, ())):
+                if offset < end <= size:
+                    stack.append((end, chain + [(offset, end)]))
+        return None
+
+    def part_sha256(self, upload_id, size):
+        """Hash of the received bytes, or None if the chunks don't cover the upload."""
+        chain = self._chunk_chain(upload_id, size)
+        if chain is None:
+            return None
+        digest = hashlib.sha256()
+        for path in chain:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def commit_part(self, upload_id, sha256, size):
+        """Concatenate a complete upload's chunks into blob storage under its hash."""
+        path = self._blob_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp, 'wb') as out:
+            for chunk_path in self._chunk_chain(upload_id, size):
+                with open(chunk_path, 'rb') as f:
+                    shutil.copyfileobj(f, out, UPLOAD_READ_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp, path)
+        self.delete_part(upload_id)
+
+    def delete_part(self, upload_id):
+        shutil.rmtree(self._chunk_dir(upload_id), ignore_errors=True)
+        try:
+            os.remove(os.path.join(self.root, 'parts', upload_id))  # single-file parts from before chunk files
+        except FileNotFoundError:
+            pass
+
+    def open_blob(self, sha256):
+        return open(self._blob_path(sha256), 'rb')
+
+
+_object_store = None
+
+
+def get_object_store():
+    global _object_store
+    if _object_store is None:
+        if UPLOAD_STORE != 'local':
+            raise ValueError(f"Unknown UPLOAD_STORE {UPLOAD_STORE!r}")
+        _object_store = LocalObjectStore(UPLOAD_DIR)
+    return _object_store
+
+
+def attachment_limit(user):
+    """Bytes of attachments one of this user's requests may carry."""
+    mb = max(mb for min_credits, mb in ATTACHMENT_LIMITS_MB if (user.credits or 0) >= min_credits)
+    return mb * 1024 * 1024
+
+
+def attached_bytes(request_id):
+    """
+    Bytes of distinct content attached to a request (the same file attached
+    twice counts once) plus those reserved by its unfinished uploads.
+    """
+    contents = db.session.query(Attachment.sha256, Attachment.size).filter(
+        Attachment.request_id == request_id
+    ).distinct().subquery()
+    attached = db.session.query(db.func.coalesce(db.func.sum(contents.c.size), 0)).scalar()
+    reserved = db.session.query(db.func.coalesce(db.func.sum(AttachmentUpload.size), 0)).filter(
+        AttachmentUpload.request_id == request_id,
+        AttachmentUpload.attachment_id.is_(None)
+    ).scalar()
+    return int(attached) + int(reserved)
+
+
+def complete_upload(upload):
+    """
+    Turn a fully received upload into an attachment. If the same bytes are
+    already stored the new copy is dropped and the blob shared, so
+    re-uploading an asset takes no extra space. Returns None (and discards
+    the upload) when the content doesn't match the hash the client declared
+    or its chunks are missing.
+    """
+    store = get_object_store()
+    sha256 = store.part_sha256(upload.id, upload.size)
+    if sha256 is None or (upload.sha256 and upload.sha256 != sha256):
+        store.delete_part(upload.id)
+        db.session.delete(upload)
         db.session.commit()
+        return None
+
+    if db.session.get(AttachmentBlob, sha256) is None:
+        store.commit_part(upload.id, sha256, upload.size)
+        db.session.execute(insert_ignoring_conflicts(AttachmentBlob, ['sha256']),
+                           [{'sha256': sha256, 'size': upload.size}])
+    else:
+        store.delete_part(upload.id)
+    attachment = Attachment(
+        request_id=upload.request_id,
+        user_id=upload.user_id,
+        sha256=sha256,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=upload.size
+    )
+    db.session.add(attachment)
+    db.session.flush()
+    upload.attachment_id = attachment.id
+    upload.received = upload.size
+    db.session.commit()
+    return attachment
+
+
+def prune_uploads(batch_size=UPLOAD_PRUNE_BATCH_SIZE):
+    """Drop uploads untouched for UPLOAD_EXPIRY_HOURS, with their partial files. Returns how many."""
+    cutoff = utcnow() - timedelta(hours=UPLOAD_EXPIRY_HOURS)
+    store = get_object_store()
+    pruned = 0
+    while True:
+        check_job_lock()
+        ids = [upload_id for (upload_id,) in db.session.query(AttachmentUpload.id).filter(
+            AttachmentUpload.updated_at < cutoff
+        ).limit(batch_size)]
+        if not ids:
+            return pruned
+        db.session.execute(db.delete(AttachmentUpload).where(
+            AttachmentUpload.id.in_(ids),
+            AttachmentUpload.updated_at < cutoff  # a chunk may have arrived since
+        ))
+        db.session.commit()
+        # Only remove the parts of rows that are really gone
+        kept = {upload_id for (upload_id,) in db.session.query(AttachmentUpload.id).filter(
+            AttachmentUpload.id.in_(ids)
+        )}
+        db.session.commit()
+        for upload_id in ids:
+            if upload_id not in kept:
+                store.delete_part(upload_id)
+                pruned += 1
+        if len(ids) < batch_size:
+            return pruned
+
+
+@app.cli.command('prune-uploads')
+def prune_uploads_command():
+    """Delete attachment uploads left unfinished for UPLOAD_EXPIRY_HOURS."""
+    print(f"Pruned {prune_uploads()} uploads.")
+
+
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def advisory_lock_key(name):
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+
+
+def acquire_lease(name, ttl=JOB_LEASE_SECONDS):
+    """
+    Take the named lease if it is free or its holder's lease has expired.
+    Returns the holder token to release it with, or None if it is taken.
+    """
+    now = utcnow()
+    holder = f"{PROCESS_ID}:{uuid.uuid4().hex[:8]}"
+    db.session.execute(insert_ignoring_conflicts(JobLease, ['name']), [{'name': name}])
+    result = db.session.execute(
+        db.update(JobLease).where(
+            JobLease.name == name,
+            db.or_(JobLease.holder.is_(None), JobLease.expires_at < now)
+        ).values(holder=holder, acquired_at=now, expires_at=now + timedelta(seconds=ttl))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return holder if result.rowcount == 1 else None
+
+
+def renew_lease(name, holder, ttl=JOB_LEASE_SECONDS):
+    """
+    Push the lease's expiry forward if `holder` still has it. Uses its own
+    connection, so it can run beside the job's transaction. Returns False
+    if the lease has been taken over.
+    """
+    now = utcnow()
+    with db.engine.begin() as conn:
+        result = conn.execute(
+            db.update(JobLease.__table__).where(JobLease.name == name, JobLease.holder == holder)
+            .values(expires_at=now + timedelta(seconds=ttl))
+        )
+    return result.rowcount == 1
+
+
+def release_lease(name, holder):
+    db.session.execute(
+        db.update(JobLease).where(JobLease.name == name, JobLease.holder == holder)
+        .values(holder=None, expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+class JobLockLost(Exception):
+    """Another process took over the lease of the job this thread is running."""
+
+
+# Leases held by jobs running on this thread: name -> Event set if it was lost
+_held_leases = threading.local()
+
+
+def check_job_lock():
+    """Raise JobLockLost if a lease this thread's job runs under was taken over; long jobs call it between batches."""
+    for name, lost in getattr(_held_leases, 'leases', {}).items():
+        if lost.is_set():
+            raise JobLockLost(name)
+
+
+def _lease_heartbeat(name, holder, stop, lost, ttl=JOB_LEASE_SECONDS):
+    with app.app_context():
+        while not stop.wait(ttl / 3):
+            try:
+                renewed = renew_lease(name, holder, ttl)
+            except Exception:
+                app.logger.exception("Could not renew the %s lease", name)
+                continue  # retried until the lease would have expired anyway
+            if not renewed:
+                app.logger.error("Lost the %s lease to another process", name)
+                lost.set()
+                return
+
+
+@contextmanager
+def job_lock(name):
+    """
+    Yield True if this process may run the named job. On Postgres a session
+    advisory lock is held on a dedicated connection and is released by the
+    server if the process dies; elsewhere a row lease in job_lease is used,
+    renewed by a heartbeat thread while the job runs and taken over by
+    another process only once its holder stops renewing it. If that happens
+    anyway (say the holder stalled), the job's next check_job_lock() raises.
+    """
+    backend = JOB_LOCK_BACKEND
+    if backend == 'auto':
+        backend = 'advisory' if db.engine.dialect.name == 'postgresql' else 'lease'
+
+    if backend == 'advisory':
+        key = advisory_lock_key(name)
+        with db.engine.connect() as conn:
+            locked = conn.execute(db.text("SELECT pg_try_advisory_lock(:key)"), {'key': key}).scalar()
+            conn.commit()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    conn.execute(db.text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+                    conn.commit()
+        return
+
+    holder = acquire_lease(name)
+    if holder is None:
+        yield False
+        return
+
+    stop, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=_lease_heartbeat, args=(name, holder, stop, lost),
+                                 name=f'lease-{name}', daemon=True)
+    heartbeat.start()
+    leases = _held_leases.__dict__.setdefault('leases', {})
+    leases[name] = lost
+    try:
+        yield True
+    finally:
+        leases.pop(name, None)
+        stop.set()
+        heartbeat.join()
+        db.session.rollback()
+        release_lease(name, holder)
+
+
+def run_exclusive(name, job):
+    """Run `job` unless another process holds its lock. Returns True if it ran."""
+    with app.app_context():
+        with job_lock(name) as locked:
+            if not locked:
+                return False
+            try:
+                job()
+            except JobLockLost:
+                db.session.rollback()
+                app.logger.warning("Periodic job %s stopped: its lease was taken over", name)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Periodic job %s failed", name)
+            return True
+
+
+def _dispatch_outbox():
+    while any(dispatch_notifications()):
+        check_job_lock()
+
+
+def scheduled_jobs(shards=SCHEDULER_SHARDS):
+    """(lock name, function, interval in seconds) for each periodic job."""
+    jobs = []
+    if shards > 1:
+        for shard in range(shards):
+            jobs.append((f'update-request-statuses:{shard + 1}/{shards}',
+                         lambda shard=shard: update_request_statuses(shard=(shard, shards)), 30))
+    else:
+        jobs.append(('update-request-statuses', update_request_statuses, 30))
+    # After the sweep so its messages go out in the same pass
+    jobs += [
+        ('expire-credits', expire_credit_lots, 3600),
+        ('roll-up-credits', roll_up_credit_transactions, 300),
+        ('archive-history', archive_history, 6 * 3600),
+        ('prune-uploads', prune_uploads, 3600),
+        ('dispatch-notifications', _dispatch_outbox, 10),
+    ]
+    return jobs
+
+
+def run_scheduler(shards=SCHEDULER_SHARDS, once=False):
+    """Run each periodic job when it is due and its lock is free."""
+    jobs = scheduled_jobs(shards)
+    next_run = {name: 0.0 for name, _, _ in jobs}
+    while True:
+        for name, job, interval in jobs:
+            if time.monotonic() >= next_run[name]:
+                run_exclusive(name, job)
+                next_run[name] = time.monotonic() + interval
+        if once:
+            return
+        time.sleep(max(0.5, min(next_run.values()) - time.monotonic()))
+
+
+@app.cli.command('run-scheduler')
+@click.option('--once', is_flag=True, help='Run every job once and exit.')
+@click.option('--shards', default=SCHEDULER_SHARDS, show_default=True,
+              help='Split the status sweep into this many user_id ranges, each locked separately.')
+def run_scheduler_command(once, shards):
+    """Run the periodic jobs, coordinating with other schedulers through DB locks."""
+    run_scheduler(shards=shards, once=once)
+
+
+_embedded_scheduler = None
+_embedded_scheduler_lock = threading.Lock()
+
+
+def start_embedded_scheduler():
+    """Start the scheduler thread in this web worker on its first request."""
+    global _embedded_scheduler
+    if _embedded_scheduler is None:
+        with _embedded_scheduler_lock:
+            if _embedded_scheduler is None:
+                _embedded_scheduler = threading.Thread(target=run_scheduler, name='scheduler', daemon=True)
+                _embedded_scheduler.start()
+
+
+if SCHEDULER_MODE == 'embedded':
+    app.before_request(start_embedded_scheduler)
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+user_summary_cache = TTLCache(USER_SUMMARY_CACHE_SIZE, USER_SUMMARY_TTL)
+
+
+class RateLimiter:
+    """
+    Small thread-safe fixed-window counter: at most `limit` hits per key
+    every `window` seconds (no limit when `limit` is 0). Keeps the
+    `maxsize` most recently hit keys.
+    """
+
+    def __init__(self, limit, window, maxsize=10000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current(self, key, now):
+        count, resets = self._counts.get(key, (0, 0))
+        return (count, resets) if resets > now else (0, now + self.window)
+
+    def blocked(self, key):
+        """True if `key` has used up its hits for this window."""
+        with self._lock:
+            return bool(self.limit) and self._current(key, time.monotonic())[0] >= self.limit
+
+    def hit(self, key):
+        """Count a hit. Returns False if it goes over the limit."""
+        with self._lock:
+            count, resets = self._current(key, time.monotonic())
+            self._counts[key] = (count + 1, resets)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+            return not self.limit or count < self.limit
+
+    def reset(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+
+login_attempts_by_ip = RateLimiter(LOGIN_ATTEMPTS_PER_IP, LOGIN_THROTTLE_WINDOW)
+login_failures_by_account = RateLimiter(LOGIN_FAILURES_PER_ACCOUNT, LOGIN_THROTTLE_WINDOW)
+
+
+class PasswordHasherBusy(Exception):
+    """No hashing slot came free within PASSWORD_HASH_WAIT_SECONDS."""
+
+
+_password_hash_slots = threading.BoundedSemaphore(max(PASSWORD_HASH_WORKERS, 1))
+_password_hash_prefix = None
+
+
+def run_password_hash(fn, *args):
+    """
+    Run a werkzeug hashing call. Every hash and verify goes through here.
+    With PASSWORD_HASH_WORKERS set, at most that many run at once in this
+    process; raises PasswordHasherBusy if no slot frees up in time.
+
+    The bound is a semaphore rather than a hashing thread pool: the request
+    thread would only block on the pool's result, and hashlib releases the
+    GIL, so running the hash on the caller gives the same concurrency limit
+    and queue timeout without a thread handoff per login.
+    """
+    if not PASSWORD_HASH_WORKERS:
+        return fn(*args)
+    if not _password_hash_slots.acquire(timeout=PASSWORD_HASH_WAIT_SECONDS):
+        raise PasswordHasherBusy()
+    try:
+        return fn(*args)
+    finally:
+        _password_hash_slots.release()
+
+
+def hash_password(password):
+    return run_password_hash(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored_hash, password):
+    return run_password_hash(check_password_hash, stored_hash, password)
+
+
+def password_needs_rehash(stored_hash):
+    """
+    True if the hash wasn't made with the current PASSWORD_HASH_METHOD and
+    its parameters. May raise PasswordHasherBusy the first time it runs.
+    """
+    global _password_hash_prefix
+    if _password_hash_prefix is None:
+        # Werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"),
+        # so take the prefix from a real hash rather than the setting
+        _password_hash_prefix = hash_password("").split("$", 1)[0]
+    return stored_hash.split("$", 1)[0] != _password_hash_prefix
+
+
+def current_user():
+    """The logged-in User for this request, loaded at most once per request."""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = db.session.get(User, user_id) if user_id else None
+    return g.current_user
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please login first.', 'info')
+            return redirect(url_for('login'))
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def read_replica(view):
+    """
+    Serve GETs of a read-only view from a replica, unless the user posted
+    something in the last REPLICA_PIN_SECONDS. Other methods use the primary.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if REPLICA_BINDS and request.method in ('GET', 'HEAD') and session.get('primary_until', 0) <= time.time():
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def _pin_to_primary(response):
+    """Read-your-writes: a user who just submitted a form reads from the primary for a while."""
+    if request.method not in ('GET', 'HEAD') and 'user_id' in session:
+        session['primary_until'] = time.time() + REPLICA_PIN_SECONDS
+    return response
+
+
+if REPLICA_BINDS:
+    app.after_request(_pin_to_primary)
+
+
+def user_summary(user_id):
+    """Name and available credits for the sidebar, served from the per-process cache."""
+    summary = user_summary_cache.get(user_id)
+    if summary is None:
+        user = current_user() if session.get('user_id') == user_id else db.session.get(User, user_id)
+        if user is None:
+            return None
+        summary = {
+            'user_name': user.name or user.email.split('@')[0].capitalize(),
+            'available_credits': user.credits
+        }
+        user_summary_cache.set(user_id, summary)
+    return summary
+
+
+def mark_user_changed(user_id):
+    """
+    Bump the user's change_version with the current transaction and drop
+    their cached summary once it commits.
+    """
+    db.session.info.setdefault('changed_users', set()).add(user_id)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_change_versions(db_session):
+    """One UPDATE per commit moves every changed user's change_version on."""
+    user_ids = db_session.info.get('changed_users')
+    if user_ids:
+        db_session.execute(
+            db.update(User).where(User.id.in_(sorted(user_ids)))
+            .values(change_version=db.func.coalesce(User.change_version, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_users(db_session):
+    for user_id in db_session.info.pop('changed_users', ()):
+        user_summary_cache.pop(user_id)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changed_users(db_session, previous_transaction):
+    db_session.info.pop('changed_users', None)
+
+
+@app.context_processor
+def inject_user_summary():
+    user_id = session.get('user_id')
+    if not user_id:
+        return {}
+    return user_summary(user_id) or {}
+
+
+def freeze(value):
+    """Recursively turn dicts and lists into read-only mappings and tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+# Credit catalog shared by the pricing page and the purchase routes.
+# Loaded once and read-only; CATALOG_VERSION changes whenever it does.
+_catalog = {
+    "packages": [
+        {
+            "name": "Starter Package",
+            "price": 299,
+            "credits": 50,
+            "price_per_credit": 5.98,
+            "description": "Perfect for small creative needs.",
+            "features": [
+                "50 service credits",
+                "Valid for 3 months",
+                "Basic support",
+                "WhatsApp notifications",
+                "2 revisions per request"
+            ]
+        },
+        {
+            "name": "Professional Package",
+            "price": 799,
+            "credits": 150,
+            "price_per_credit": 5.33,
+            "popular": True,
+            "description": "Ideal for growing creative teams.",
+            "features": [
+                "150 service credits",
+                "Valid for 6 months",
+                "Priority support",
+                "WhatsApp notifications",
+                "Unlimited revisions",
+                "48-hour turnaround"
+            ]
+        },
+        {
+            "name": "Enterprise Package",
+            "price": 1899,
+            "credits": 400,
+            "price_per_credit": 4.75,
+            "description": "For high-volume creative workflows.",
+            "features": [
+                "400 service credits",
+                "Valid for 12 months",
+                "24/7 priority support",
+                "WhatsApp & Slack notifications",
+                "Unlimited revisions",
+                "24-hour turnaround",
+                "Dedicated account manager"
+            ]
+        }
+    ],
+    # Top-up credit packs
+    "topups": [
+        { "credits": 10, "cost": 69, "bonus": 0 },
+        { "credits": 27, "cost": 159, "bonus": 2 },
+        { "credits": 55, "cost": 299, "bonus": 5 },
+        { "credits": 115, "cost": 549, "bonus": 15 },
+    ]
+}
+CATALOG_VERSION = hashlib.sha256(json.dumps(_catalog, sort_keys=True).encode()).hexdigest()[:12]
+CATALOG = freeze(_catalog)
+del _catalog
+
+
+def find_package(name):
+    return next((p for p in CATALOG["packages"] if p["name"] == name), None)
+
+
+def find_topup(credits):
+    return next((t for t in CATALOG["topups"] if str(t["credits"]) == str(credits)), None)
+
+
+# Rendered public pages: (endpoint, logged in, catalog version) -> (body, etag).
+# These pages only change on deploy, which starts a fresh process anyway.
+_public_page_cache = {}
+
+
+def cached_public_page(template, **context):
+    """
+    Render a public page once per process and serve it with a strong ETag,
+    so repeat visitors and CDNs get 304s. The navigation differs for
+    logged-in users, so that variant is cached separately and marked private.
+    """
+    logged_in = 'user_id' in session
+    key = (request.endpoint, logged_in, CATALOG_VERSION)
+    entry = _public_page_cache.get(key)
+    if entry is None or app.debug:
+        body = render_template(template, **context)
+        entry = (body, hashlib.sha256(body.encode()).hexdigest()[:32])
+        _public_page_cache[key] = entry
+
+    body, etag = entry
+    response = make_response(body)
+    response.set_etag(etag)
+    visibility = 'private' if logged_in else 'public'
+    response.headers['Cache-Control'] = f'{visibility}, max-age={PUBLIC_PAGE_MAX_AGE}'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+# Fingerprinted assets written by scripts/build_assets.py. Without a build
+# the manifest is empty and templates fall back to plain /static URLs.
+STATIC_DIST_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(STATIC_DIST_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}, "images": {}, "encodings": {}}
+
+
+ASSET_MANIFEST = load_asset_manifest()
+IMAGE_SOURCE_TYPES = (("avif", "image/avif"), ("webp", "image/webp"))
+IMAGE_FALLBACK_FORMATS = ("jpeg", "png")  # resized in the original's format, for the <img> itself
+
+
+@app.template_global()
+def asset_url(filename):
+    built = ASSET_MANIFEST["files"].get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('dist_asset', filename=built)
+
+
+@app.template_global()
+def image_sources(filename):
+    """<source> entries (type, srcset) for a built image, best format first."""
+    variants = ASSET_MANIFEST["images"].get(filename, {}).get("variants", {})
+    return [
+        {
+            "type": mimetype,
+            "srcset": ", ".join(f"{url_for('dist_asset', filename=name)} {width}w" for width, name in variants[fmt]),
+        }
+        for fmt, mimetype in IMAGE_SOURCE_TYPES if fmt in variants
+    ]
+
+
+@app.template_global()
+def image_fallback(filename):
+    """src and srcset for the <img> in a <picture>: the resized original-format variants when built."""
+    variants = ASSET_MANIFEST["images"].get(filename, {}).get("variants", {})
+    for fmt in IMAGE_FALLBACK_FORMATS:
+        if fmt in variants:
+            # src is for browsers without srcset; the widest variant below full size is plenty
+            widths = variants[fmt][:-1] or variants[fmt]
+            return {
+                "src": url_for('dist_asset', filename=widths[-1][1]),
+                "srcset": ", ".join(f"{url_for('dist_asset', filename=name)} {width}w" for width, name in variants[fmt]),
+            }
+    return {"src": asset_url(filename), "srcset": None}
+
+
+@app.route('/assets/<path:filename>')
+def dist_asset(filename):
+    """
+    Serve a fingerprinted build output. Names change with content, so these
+    are cached for a year; text assets use the precompressed .br/.gz file
+    when the client accepts it.
+    """
+    encodings = ASSET_MANIFEST["encodings"].get(filename, ())
+    served, content_encoding = filename, None
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in encodings and request.accept_encodings[encoding]:
+            served, content_encoding = filename + suffix, encoding
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    response = send_from_directory(STATIC_DIST_DIR, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness plus database reachability and connection pool usage."""
+    try:
+        db.session.execute(db.text('SELECT 1'))
+        database = 'ok'
+    except Exception as exc:
+        app.logger.warning("Health check database ping failed: %s", exc)
+        database = 'unavailable'
+    finally:
+        db.session.rollback()
+    replicas = {}
+    for name in REPLICA_BINDS:
+        try:
+            with db.engines[name].connect() as conn:
+                conn.execute(db.text('SELECT 1'))
+            replicas[name] = 'ok'
+        except Exception as exc:
+            app.logger.warning("Health check ping of %s failed: %s", name, exc)
+            replicas[name] = 'unavailable'
+    healthy = database == 'ok' and all(state == 'ok' for state in replicas.values())
+    body = {"status": "ok" if healthy else "degraded", "database": database, "pool": pool_status()}
+    if replicas:
+        body["replicas"] = replicas
+    response = make_response(body, 200 if database == 'ok' else 503)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-        return True
 
-    return False
+@app.route('/metrics')
+def metrics():
+    if not INSTRUMENTATION:
+        return Response("Instrumentation is disabled; set INSTRUMENTATION=1.\n", 404, mimetype='text/plain')
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response("Unauthorized\n", 401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
 def home():
-    return render_template('home.html')
+    return cached_public_page('home.html')
 
 @app.route('/favicon.ico')
 def favicon():
     return redirect(url_for('static', filename='favicon.ico'))
 
+def login_refused(message, status, retry_after):
+    flash(message, 'danger')
+    response = make_response(render_template('login.html'), status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email'].strip().lower()
         password = request.form['password']
 
+        # Throttle before hashing, so refused attempts cost no CPU
+        if not login_attempts_by_ip.hit(request.remote_addr) or login_failures_by_account.blocked(email):
+            return login_refused('Too many login attempts. Please wait a minute and try again.',
+                                 429, LOGIN_THROTTLE_WINDOW)
+
         user = User.query.filter_by(email=email).first()
 
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = user is not None and verify_password(user.password, password)
+        except PasswordHasherBusy:
+            return login_refused('Login is busy right now. Please try again in a moment.', 503, 1)
+
+        if valid:
+            login_failures_by_account.reset(email)
+            try:
+                if password_needs_rehash(user.password):
+                    user.password = hash_password(password)
+                    db.session.commit()
+            except PasswordHasherBusy:
+                pass  # upgraded on a later login
             session['user_id'] = user.id
             session['email'] = user.email
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            login_failures_by_account.hit(email)
             flash('Invalid email or password', 'danger')
             return redirect(url_for('login'))
 
@@ -204,9 +3104,26 @@ def signup():
             flash('Email already exists. Please login.', 'warning')
             return redirect(url_for('login'))
 
-        hashed_pw = generate_password_hash(password)
+        try:
+            hashed_pw = hash_password(password)
+        except PasswordHasherBusy:
+            flash('Sign up is busy right now. Please try again in a moment.', 'warning')
+            return redirect(url_for('signup'))
         new_user = User(email=email, password=hashed_pw, name=name)
         db.session.add(new_user)
+        db.session.flush()
+
+        # Record the demo credits every account starts with as their own lot
+        welcome = CreditTransaction(
+            user_id=new_user.id,
+            type='bonus',
+            description="Welcome credits",
+            amount=new_user.credits,
+            expiry_date=new_user.expiry_date
+        )
+        db.session.add(welcome)
+        add_credit_lot(new_user.id, new_user.credits, new_user.expiry_date, transaction=welcome)
+        refresh_expiry_summary(new_user.id)
         db.session.commit()
 
         flash('Account created successfully! Please login.', 'success')
@@ -217,7 +3134,7 @@ def signup():
 
 @app.route('/services')
 def services():
-    return render_template('services.html')
+    return cached_public_page('services.html')
 
 @app.route('/logout')
 def logout():
@@ -228,113 +3145,36 @@ def logout():
 
 @app.route('/about')
 def about():
-    return render_template('about.html')
-
-
-# Pricing plans
-plans = [
-    {
-        "name": "Starter Package",
-        "price": 299,
-        "credits": 50,
-        "price_per_credit": 5.98,
-        "features": [
-            "50 service credits",
-            "Valid for 3 months",
-            "Basic support",
-            "WhatsApp notifications",
-            "2 revisions per request"
-        ]
-    },
-    {
-        "name": "Professional Package",
-        "price": 799,
-        "credits": 150,
-        "price_per_credit": 5.33,
-        "popular": True,
-        "features": [
-            "150 service credits",
-            "Valid for 6 months",
-            "Priority support",
-            "WhatsApp notifications",
-            "Unlimited revisions",
-            "48-hour turnaround"
-        ]
-    },
-    {
-        "name": "Enterprise Package",
-        "price": 1899,
-        "credits": 400,
-        "price_per_credit": 4.75,
-        "features": [
-            "400 service credits",
-            "Valid for 12 months",
-            "24/7 priority support",
-            "WhatsApp & Slack notifications",
-            "Unlimited revisions",
-            "24-hour turnaround",
-            "Dedicated account manager"
-        ]
-    }
-]
+    return cached_public_page('about.html')
 
-# Top-up credit packs
-topups = [
-    { "credits": 10, "cost": 69, "bonus": 0 },
-    { "credits": 27, "cost": 159, "bonus": 2 },
-    { "credits": 55, "cost": 299, "bonus": 5 },
-    { "credits": 115, "cost": 549, "bonus": 15 },
-]
 
 @app.route("/pricing")
 def pricing():
-    return render_template("pricing.html", plans=plans, topups=topups)
+    return cached_public_page("pricing.html", plans=CATALOG["packages"], topups=CATALOG["topups"])
 
 
 # Define the route for the main dashboard page
 @app.route('/dashboard')
+@login_required
+@read_replica
 def dashboard():
-    # Require login
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
-    
-    user = User.query.get(session['user_id'])
+    user = current_user()
     if not user:
         session.clear()
         flash('User not found. Please login again.', 'danger')
         return redirect(url_for('login'))
 
-    # Get user info
-    user = User.query.get(session['user_id'])
-
-    # 🕒 Expiry check right after login
-    if check_and_expire_credits(user):
-        flash('Your expired credits have been removed.', 'warning')
-
-    # Calculate credits used total (from transactions if needed)
-    credits_used_total = user.credits_used_total or 0
-
-    # Optionally double-check with transactions table (for accuracy)
-    credits_used_from_txn = db.session.query(
-        db.func.sum(CreditTransaction.amount)
-    ).filter(
-        CreditTransaction.user_id == user.id,
-        CreditTransaction.type == 'use'
-    ).scalar()
-
-    # Convert negative sum to positive number
-    if credits_used_from_txn:
-        credits_used_total = abs(credits_used_from_txn)
-
-    # Fallback values if new user has no data yet
+    # Counters are kept up to date by the write paths (see bump_user_counters)
     user_name = user.name or user.email.split('@')[0].capitalize()
     available_credits = user.credits
+    user_summary_cache.set(user.id, {'user_name': user_name, 'available_credits': available_credits})
     expiring_credits = user.expiring_credits
     expiry_date = user.expiry_date
-    active_requests = ServiceRequest.query.filter_by(user_id=user.id, status='Pending').count()
-    completed_requests_month =ServiceRequest.query.filter_by(user_id=user.id, status='Completed').count()
-
+    active_requests = user.active_requests or 0
+    credits_used_total = user.credits_used_total or 0
+    completed_requests_month = 0
+    if user.counters_month == current_month():
+        completed_requests_month = user.completed_requests_month or 0
 
     # Pass user data to dashboard template
     return render_template(
@@ -357,13 +3197,9 @@ SERVICE_CREDIT_COST = {
 }
 
 @app.route('/new_request', methods=['GET', 'POST'])
+@login_required
 def new_request():
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
-
-    user = User.query.get(session['user_id'])
-    available_credits = user.credits
+    user = current_user()
 
     if request.method == 'POST':
         service_type = request.form.get('service_type')
@@ -374,23 +3210,29 @@ def new_request():
             flash('All fields are required!', 'danger')
             return redirect(url_for('new_request'))
 
-        # Check if user has enough credits
         required_credits = SERVICE_CREDIT_COST.get(service_type, 0)
-        if user.credits < required_credits:
+
+        if not claim_idempotency_key(user.id, 'new_request'):
+            flash('This request was already submitted.', 'info')
+            return redirect(url_for('my_requests'))
+
+        # Deduct credits atomically; fails if a concurrent submission spent them first
+        if not spend_credits(user.id, required_credits):
             flash(f'You do not have enough credits for this service. Required: {required_credits}', 'danger')
             return redirect(url_for('new_request'))
 
-        # Deduct credits
-        user.credits -= required_credits
-
         # Create new service request
+        now = utcnow()
         new_req = ServiceRequest(
             user_id=user.id,
             service_type=service_type,
             title=title,
-            description=description
+            description=description,
+            created_at=now,
+            next_transition_at=next_transition_time(service_type, "Pending", now)
         )
         db.session.add(new_req)
+        record_status_changes([(user.id, now, service_type, None, "Pending")])
 
         # Log this usage in the CreditTransaction table
         usage_transaction = CreditTransaction(
@@ -400,28 +3242,149 @@ def new_request():
             amount=-required_credits  # negative value to represent deduction
         )
         db.session.add(usage_transaction)
+        bump_user_counters(user.id, active=1, credits_used=required_credits)
+        refresh_expiry_summary(user.id)
         db.session.commit()
 
         flash(f'Your request has been submitted! {required_credits} credits deducted.', 'success')
         return redirect(url_for('my_requests'))
 
-    return render_template('new_request.html', available_credits=available_credits)
+    return render_template(
+        'new_request.html',
+        idempotency_key=new_idempotency_key()
+    )
 
-@app.route('/my_requests')
-def my_requests():
-    # Static data for the request status boxes (based on your image)
-    user = User.query.get(session['user_id'])
-    available_credits = user.credits
+REQUEST_STATUSES = ["Pending", "In Progress", "Completed", "Cancelled"]
+REQUESTS_PAGE_SIZE = 20
 
-    # Fetch all requests for this user (latest first)
-    requests_list = (
-        ServiceRequest.query.filter_by(user_id=user.id)
-        .order_by(ServiceRequest.created_at.desc())
-        .all()
+
+def encode_cursor(created_at, row_id):
+    """Encode the last row of a page as an opaque keyset cursor."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor(). Returns None if missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, binascii.Error):
+        return None
+
+
+def keyset_before(created_col, id_col, cursor):
+    """Filter for rows that sort after `cursor` in (created_at, id) DESC order."""
+    created_at, row_id = cursor
+    return db.or_(
+        created_col < created_at,
+        db.and_(created_col == created_at, id_col < row_id)
     )
 
-    # Calculate request status counts for dashboard summary
-    # Compute request status counts
+
+def requests_page_query(user_id, status=None, service_type=None, cursor=None, model=ServiceRequest):
+    """
+    One page of a user's requests, newest first. Only the columns the list
+    shows are selected, and the description is cut to a preview in SQL.
+    Pass model=ArchivedServiceRequest for the same page of archived requests.
+    """
+    query = db.session.query(
+        model.id,
+        model.service_type,
+        model.title,
+        model.status,
+        model.created_at,
+        db.func.substr(model.description, 1, 40).label('description_preview')
+    ).filter(model.user_id == user_id)
+
+    if status:
+        query = query.filter(model.status == status)
+    if service_type:
+        query = query.filter(model.service_type == service_type)
+    if cursor:
+        query = query.filter(keyset_before(model.created_at, model.id, cursor))
+
+    return query.order_by(model.created_at.desc(), model.id.desc())
+
+
+def newest_first(queries, limit):
+    """
+    Merge newest-first queries over a hot table and its archive. Each one is
+    limited on its own (user_id, created_at, id) index before the merge.
+    """
+    merged = db.union_all(*[db.select(query.limit(limit).subquery()) for query in queries]).subquery()
+    return db.session.execute(
+        db.select(merged).order_by(merged.c.created_at.desc(), merged.c.id.desc()).limit(limit)
+    ).all()
+
+
+SEARCH_QUERY_MAX_LENGTH = 200
+
+
+def fts5_match_expression(text):
+    """
+    Turn free text into a safe FTS5 query: every word must match, and the
+    last one may be a prefix (so results show up while typing).
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return " ".join(terms)
+
+
+def search_requests_query(user_id, text, status=None, service_type=None):
+    """
+    A user's requests matching `text` in title or description, best match
+    first. Uses the FTS5 index on SQLite and the tsvector GIN index on
+    PostgreSQL; other databases fall back to LIKE.
+    """
+    dialect = db.engine.dialect.name
+    columns = [
+        ServiceRequest.id,
+        ServiceRequest.service_type,
+        ServiceRequest.title,
+        ServiceRequest.status,
+        ServiceRequest.created_at,
+        db.func.substr(ServiceRequest.description, 1, 40).label('description_preview'),
+    ]
+
+    if dialect == 'sqlite':
+        match = fts5_match_expression(text)
+        if match is None:
+            return None
+        fts = db.table('service_request_fts', db.column('rowid'))
+        # bm25 is lower for better matches; titles weigh more than descriptions
+        rank = db.literal_column('bm25(service_request_fts, 10.0, 1.0)')
+        query = db.session.query(*columns).join(fts, fts.c.rowid == ServiceRequest.id).filter(
+            db.text('service_request_fts MATCH :match').bindparams(match=match)
+        ).order_by(rank, ServiceRequest.id.desc())
+    elif dialect == 'postgresql':
+        tsquery = db.func.websearch_to_tsquery('english', text)
+        vector = db.literal_column('service_request.search_vector')
+        query = db.session.query(*columns).filter(vector.op('@@')(tsquery)).order_by(
+            db.func.ts_rank_cd(vector, tsquery).desc(), ServiceRequest.id.desc()
+        )
+    else:
+        pattern = f"%{text}%"
+        query = db.session.query(*columns).filter(
+            db.or_(ServiceRequest.title.ilike(pattern), ServiceRequest.description.ilike(pattern))
+        ).order_by(ServiceRequest.created_at.desc(), ServiceRequest.id.desc())
+
+    query = query.filter(ServiceRequest.user_id == user_id)
+    if status:
+        query = query.filter(ServiceRequest.status == status)
+    if service_type:
+        query = query.filter(ServiceRequest.service_type == service_type)
+    return query
+
+
+def request_status_counts(user_id):
+    """Count a user's requests per status with a single GROUP BY, plus archived ones."""
     statuses = {
         'pending': 0,
         'in_progress': 0,
@@ -429,119 +3392,462 @@ def my_requests():
         'cancelled': 0
     }
 
-    for req in requests_list:
-        key = req.status.lower().replace(" ", "_")  # normalize status
-        if key in statuses:
-            statuses[key] += 1
+    rows = db.session.query(
+        ServiceRequest.status, db.func.count(ServiceRequest.id)
+    ).filter(
+        ServiceRequest.user_id == user_id
+    ).group_by(ServiceRequest.status).all()
+
+    for status, count in rows:
+        key = (status or '').lower().replace(" ", "_")  # normalize status
+        statuses[key] = statuses.get(key, 0) + count
+
+    snapshot = db.session.get(ArchiveSnapshot, user_id)
+    if snapshot:
+        statuses['completed'] += snapshot.completed_requests
+        statuses['cancelled'] += snapshot.cancelled_requests
+    return statuses
+
+
+@app.route('/my_requests')
+@login_required
+@read_replica
+def my_requests():
+    user_id = session['user_id']
+
+    # Optional filters; unknown values are ignored rather than matching nothing
+    status_filter = request.args.get('status')
+    if status_filter not in REQUEST_STATUSES:
+        status_filter = None
+    service_filter = request.args.get('service_type')
+    if service_filter not in SERVICE_CREDIT_COST:
+        service_filter = None
+
+    search_query = (request.args.get('q') or '').strip()[:SEARCH_QUERY_MAX_LENGTH]
+    include_archived = request.args.get('archived') == '1'
+    cursor = decode_cursor(request.args.get('cursor'))
+    page = request.args.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    next_cursor = next_page = None
+
+    # Fetch one extra row to know whether another page exists
+    if search_query:
+        # Ranked results don't follow created_at, so they page by offset
+        query = search_requests_query(user_id, search_query, status=status_filter, service_type=service_filter)
+        rows = query.offset((page - 1) * REQUESTS_PAGE_SIZE).limit(REQUESTS_PAGE_SIZE + 1).all() if query else []
+        if len(rows) > REQUESTS_PAGE_SIZE:
+            next_page = page + 1
+    else:
+        page = 1
+        query = requests_page_query(user_id, status=status_filter, service_type=service_filter, cursor=cursor)
+        if include_archived:
+            rows = newest_first([query, requests_page_query(
+                user_id, status=status_filter, service_type=service_filter, cursor=cursor,
+                model=ArchivedServiceRequest
+            )], REQUESTS_PAGE_SIZE + 1)
         else:
-            # In case there are unexpected statuses
-            statuses[key] = 1
+            rows = query.limit(REQUESTS_PAGE_SIZE + 1).all()
+        if len(rows) > REQUESTS_PAGE_SIZE:
+            last = rows[REQUESTS_PAGE_SIZE - 1]
+            next_cursor = encode_cursor(last.created_at, last.id)
+    requests_list = rows[:REQUESTS_PAGE_SIZE]
+
+    attachments = {}
+    if requests_list:
+        for attachment in db.session.query(Attachment.id, Attachment.request_id, Attachment.filename).filter(
+            Attachment.request_id.in_([row.id for row in requests_list]),
+            Attachment.user_id == user_id
+        ).order_by(Attachment.id):
+            attachments.setdefault(attachment.request_id, []).append(attachment)
 
     return render_template(
         'my_request.html',
-        available_credits=available_credits,
         requests_list=requests_list,
-        statuses=statuses,
-        SERVICE_CREDIT_COST=SERVICE_CREDIT_COST
+        attachments=attachments,
+        statuses=request_status_counts(user_id),
+        SERVICE_CREDIT_COST=SERVICE_CREDIT_COST,
+        request_statuses=REQUEST_STATUSES,
+        status_filter=status_filter,
+        service_filter=service_filter,
+        search_query=search_query,
+        archived='1' if include_archived else None,
+        next_cursor=next_cursor,
+        next_page=next_page,
+        page=page,
+        is_first_page=cursor is None and page == 1,
+        status_stream=STATUS_STREAM,
+        status_poll_seconds=STATUS_POLL_SECONDS
     )
 
+STATUS_API_MAX_IDS = 100
+STATUS_STREAM_POLL_SECONDS = 2
+# Streams end before typical serverless time limits; EventSource reconnects
+STATUS_STREAM_MAX_SECONDS = int(os.getenv("STATUS_STREAM_MAX_SECONDS", "55"))
+
+
+def requested_ids():
+    """Request ids from ?ids=1,2,3 (the rows a page is showing), capped."""
+    ids = []
+    for value in request.args.get('ids', '').split(',')[:STATUS_API_MAX_IDS]:
+        if value.strip().isdigit():
+            ids.append(int(value))
+    return ids
+
+
+def status_payload(user, ids):
+    """Status counts, balance and the statuses of the given requests for the JSON API."""
+    rows = []
+    if ids:
+        rows = db.session.query(ServiceRequest.id, ServiceRequest.status).filter(
+            ServiceRequest.user_id == user.id,
+            ServiceRequest.id.in_(ids)
+        ).all()
+    return {
+        'version': user.change_version or 0,
+        'credits': user.credits,
+        'statuses': request_status_counts(user.id),
+        'requests': {str(row.id): row.status for row in rows},
+    }
+
+
+def status_etag(user_id, version, ids):
+    return hashlib.sha256(f"{user_id}:{version}:{ids}".encode()).hexdigest()[:32]
+
+
+@app.route('/api/status')
+@read_replica
+def api_status():
+    """
+    Request statuses and balance as JSON. The ETag only depends on the
+    user's change_version, so an unchanged poll is one primary-key lookup
+    and a 304.
+    """
+    user = current_user()
+    if user is None:
+        return make_response({'error': 'login required'}, 401)
+
+    ids = requested_ids()
+    etag = status_etag(user.id, user.change_version or 0, ids)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(status_payload(user, ids))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/status/stream')
+@read_replica
+def api_status_stream():
+    """
+    Server-sent events: a `status` event with the api_status payload
+    whenever the user's change_version moves. The sweep runs in another
+    process, so this checks the version every few seconds (a primary-key
+    read, with the connection returned to the pool in between). Only served
+    with STATUS_STREAM=1, since each client holds a worker.
+    """
+    if not STATUS_STREAM:
+        return make_response({'error': 'status stream is disabled; poll /api/status'}, 404)
+    user = current_user()
+    if user is None:
+        return make_response({'error': 'login required'}, 401)
+    user_id, ids = user.id, requested_ids()
+    last_seen = request.headers.get('Last-Event-ID')
+
+    def events():
+        seen = int(last_seen) if last_seen and last_seen.isdigit() else None
+        yield f"retry: {STATUS_STREAM_POLL_SECONDS * 1000}\n\n"
+        deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+        last_write = time.monotonic()
+        while time.monotonic() < deadline:
+            version = db.session.query(User.change_version).filter(User.id == user_id).scalar() or 0
+            if version != seen:
+                payload = status_payload(db.session.get(User, user_id, populate_existing=True), ids)
+                seen = payload['version']
+                yield f"id: {seen}\nevent: status\ndata: {json.dumps(payload)}\n\n"
+                last_write = time.monotonic()
+            elif time.monotonic() - last_write >= 15:
+                yield ": keep-alive\n\n"
+                last_write = time.monotonic()
+            db.session.close()
+            time.sleep(STATUS_STREAM_POLL_SECONDS)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @app.route('/cancel_request/<int:request_id>', methods=['POST'])
+@login_required
 def cancel_request(request_id):
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
     req = ServiceRequest.query.get(request_id)
     if not req or req.user_id != session['user_id']:
         flash('Request not found.', 'danger')
         return redirect(url_for('my_requests'))
 
-    req.status = "Cancelled"
+    # Conditional update so a cancel racing the status sweep can't double count
+    # (and the rollup moves the request out of the status it was really in)
+    result = db.session.execute(
+        db.update(ServiceRequest).where(
+            ServiceRequest.id == req.id,
+            ServiceRequest.status == req.status,
+            ServiceRequest.status.in_(OPEN_STATUSES)
+        ).values(status="Cancelled", next_transition_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        flash('This request can no longer be cancelled.', 'warning')
+        return redirect(url_for('my_requests'))
+
+    bump_user_counters(req.user_id, active=-1)
+    if req.created_at is not None:
+        record_status_changes([(req.user_id, req.created_at, req.service_type, req.status, "Cancelled")])
+    send_whatsapp(
+        req.user.whatsapp_number, f"Your request '{req.title}' has been cancelled.",
+        user_id=req.user_id, dedupe_key=f"request:{req.id}:Cancelled"
+    )
     db.session.commit()
-    send_whatsapp(req.user.whatsapp_number, f"Your request '{req.title}' has been cancelled.")
     flash('Request cancelled successfully!', 'success')
     return redirect(url_for('my_requests'))
 
 
-@app.route('/buy_package', methods=['GET', 'POST'])
-def buy_package():
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def upload_state(upload):
+    """What a client needs to send the next chunk (or the attachment, once there is one)."""
+    state = {
+        'upload_id': upload.id,
+        'url': url_for('upload_chunk', upload_id=upload.id),
+        'offset': upload.received,
+        'size': upload.size,
+        'chunk_size': UPLOAD_CHUNK_MB * 1024 * 1024,
+    }
+    if upload.attachment_id is not None:
+        state['attachment'] = attachment_payload(db.session.get(Attachment, upload.attachment_id))
+    return state
+
+
+def attachment_payload(attachment):
+    return {
+        'id': attachment.id,
+        'filename': attachment.filename,
+        'size': attachment.size,
+        'sha256': attachment.sha256,
+        'url': url_for('download_attachment', attachment_id=attachment.id),
+    }
+
+
+def read_request_body(length):
+    """The request body in UPLOAD_READ_SIZE pieces, never more than length bytes."""
+    remaining = length
+    while remaining > 0:
+        chunk = request.stream.read(min(UPLOAD_READ_SIZE, remaining))
+        if not chunk:
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+
+@app.route('/api/requests/<int:request_id>/uploads', methods=['POST'])
+def create_upload(request_id):
+    """
+    Start an attachment upload. JSON body: filename, size and optionally
+    content_type and sha256. If this user already attached content with
+    that hash, the attachment is created at once and nothing is uploaded.
+    """
+    user = current_user()
+    if user is None:
+        return make_response({'error': 'login required'}, 401)
+
+    # Locked so concurrent uploads to one request can't overrun its limit together
+    req = db.session.query(ServiceRequest).filter(
+        ServiceRequest.id == request_id,
+        ServiceRequest.user_id == user.id
+    ).with_for_update().first()
+    if req is None:
+        return make_response({'error': 'request not found'}, 404)
+    if req.status not in OPEN_STATUSES:
+        return make_response({'error': 'files can only be attached to open requests'}, 409)
+
+    data = request.get_json(silent=True) or {}
+    filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/')).strip()[:255]
+    size = data.get('size')
+    sha256 = str(data.get('sha256') or '').lower() or None
+    if not filename or not isinstance(size, int) or size <= 0:
+        return make_response({'error': 'filename and a positive size are required'}, 400)
+    if sha256 and not SHA256_PATTERN.fullmatch(sha256):
+        return make_response({'error': 'sha256 must be 64 hex digits'}, 400)
+    content_type = (str(data.get('content_type') or '') or mimetypes.guess_type(filename)[0]
+                    or 'application/octet-stream')[:100]
+
+    # Only content this user has attached before: a hash alone must not
+    # unlock someone else's file. Other repeats are still stored once.
+    known = sha256 and db.session.query(Attachment.request_id).filter(
+        Attachment.user_id == user.id, Attachment.sha256 == sha256, Attachment.size == size
+    ).order_by(Attachment.request_id != req.id).first()
+
+    limit = attachment_limit(user)
+    if not (known and known.request_id == req.id) and attached_bytes(req.id) + size > limit:
+        return make_response({
+            'error': f'Attachments on a request are limited to {limit // (1024 * 1024)} MB with your balance.',
+            'limit': limit,
+        }, 413)
+
+    if known:
+        attachment = Attachment(request_id=req.id, user_id=user.id, sha256=sha256, filename=filename,
+                                content_type=content_type, size=size)
+        db.session.add(attachment)
+        db.session.commit()
+        return make_response({'attachment': attachment_payload(attachment), 'deduplicated': True}, 201)
+
+    upload = AttachmentUpload(
+        id=uuid.uuid4().hex,
+        request_id=req.id,
+        user_id=user.id,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        sha256=sha256
+    )
+    db.session.add(upload)
+    db.session.commit()
+    return make_response(upload_state(upload), 201)
+
+
+def own_upload(upload_id):
+    user_id = session.get('user_id')
+    upload = db.session.get(AttachmentUpload, upload_id) if user_id else None
+    return upload if upload is not None and upload.user_id == user_id else None
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """How much of an upload the server has: resume by sending from `offset`."""
     if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
+        return make_response({'error': 'login required'}, 401)
+    upload = own_upload(upload_id)
+    if upload is None:
+        return make_response({'error': 'upload not found'}, 404)
+    response = make_response(upload_state(upload))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-    user = User.query.get(session['user_id'])
-    available_credits = user.credits
 
-    # Prepare package data
-    packages = [
-        {
-            "name": "Starter Package",
-            "price": 299,
-            "credits": 50,
-            "price_per_credit": 5.98,
-            "description": "Perfect for small creative needs.",
-            "features": [
-                "50 service credits",
-                "Valid for 3 months",
-                "Basic support",
-                "WhatsApp notifications",
-                "2 revisions per request"
-            ],
-            "is_popular": False,
-            "is_selected": True  # default selection
-        },
-        {
-            "name": "Professional Package",
-            "price": 799,
-            "credits": 150,
-            "price_per_credit": 5.33,
-            "description": "Ideal for growing creative teams.",
-            "features": [
-                "150 service credits",
-                "Valid for 6 months",
-                "Priority support",
-                "WhatsApp notifications",
-                "Unlimited revisions",
-                "48-hour turnaround"
-            ],
-            "is_popular": True,
-            "is_selected": False
-        },
-        {
-            "name": "Enterprise Package",
-            "price": 1899,
-            "credits": 400,
-            "price_per_credit": 4.75,
-            "description": "For high-volume creative workflows.",
-            "features": [
-                "400 service credits",
-                "Valid for 12 months",
-                "24/7 priority support",
-                "WhatsApp & Slack notifications",
-                "Unlimited revisions",
-                "24-hour turnaround",
-                "Dedicated account manager"
-            ],
-            "is_popular": False,
-            "is_selected": False
-        }
-    ]
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Append one chunk, sent as the raw body with a Content-Range header
+    starting at the upload's current offset. The body is streamed to the
+    object store in small pieces; the offset only moves once the chunk is
+    safely written, so an interrupted chunk is simply sent again.
+    """
+    if 'user_id' not in session:
+        return make_response({'error': 'login required'}, 401)
+    upload = own_upload(upload_id)
+    if upload is None:
+        return make_response({'error': 'upload not found'}, 404)
+    if upload.attachment_id is not None:
+        return make_response(upload_state(upload))
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes' or content_range.length != upload.size:
+        return make_response({'error': f'Content-Range must be "bytes start-end/{upload.size}"'}, 400)
+    start, length = content_range.start, content_range.stop - content_range.start
+    if request.content_length != length:
+        return make_response({'error': 'Content-Length must match Content-Range'}, 400)
+    if length > UPLOAD_CHUNK_MB * 1024 * 1024:
+        return make_response({'error': f'Chunks are limited to {UPLOAD_CHUNK_MB} MB'}, 413)
+    if start != upload.received:
+        return make_response({'error': 'chunk does not start at the current offset', 'offset': upload.received}, 409)
+
+    # Don't hold a connection while the body streams in
+    db.session.close()
+    written = get_object_store().write_part(upload_id, start, length, read_request_body(length))
+    if written != length:
+        return make_response({'error': 'chunk was cut short; resend it', 'offset': start}, 400)
+
+    # Conditional so a duplicate or concurrent copy of this chunk can't move the offset twice
+    result = db.session.execute(
+        db.update(AttachmentUpload).where(
+            AttachmentUpload.id == upload_id,
+            AttachmentUpload.received == start,
+            AttachmentUpload.attachment_id.is_(None)
+        ).values(received=start + length, updated_at=utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    upload = db.session.get(AttachmentUpload, upload_id)
+    if result.rowcount == 0:
+        return make_response({'error': 'chunk does not start at the current offset', 'offset': upload.received}, 409)
+
+    if upload.received == upload.size:
+        if complete_upload(upload) is None:
+            return make_response({'error': 'the file is incomplete or does not match its sha256; upload it again'}, 422)
+    return make_response(upload_state(upload))
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Abandon an unfinished upload and its partial file."""
+    if 'user_id' not in session:
+        return make_response({'error': 'login required'}, 401)
+    upload = own_upload(upload_id)
+    if upload is None or upload.attachment_id is not None:
+        return make_response({'error': 'upload not found'}, 404)
+    db.session.delete(upload)
+    db.session.commit()
+    get_object_store().delete_part(upload_id)
+    return make_response('', 204)
+
+
+@app.route('/attachments/<int:attachment_id>')
+@login_required
+@read_replica
+def download_attachment(attachment_id):
+    attachment = db.session.get(Attachment, attachment_id)
+    if attachment is None or attachment.user_id != session['user_id']:
+        flash('Attachment not found.', 'danger')
+        return redirect(url_for('my_requests'))
+    response = send_file(
+        get_object_store().open_blob(attachment.sha256),
+        mimetype=attachment.content_type,
+        as_attachment=True,
+        download_name=attachment.filename,
+        etag=attachment.sha256,
+        max_age=3600
+    )
+    response.cache_control.private = True
+    return response
+
+
+@app.route('/buy_package', methods=['GET', 'POST'])
+@login_required
+def buy_package():
+    user = current_user()
 
     # Handle package purchase (POST)
     if request.method == 'POST':
         selected_name = request.form.get('selected_package')
 
         # Find the selected package
-        selected_package = next((p for p in packages if p["name"] == selected_name), None)
+        selected_package = find_package(selected_name)
         if not selected_package:
             flash('Invalid package selection.', 'danger')
             return redirect(url_for('buy_package'))
 
+        if not claim_idempotency_key(user.id, 'buy_package'):
+            flash('This purchase was already processed.', 'info')
+            return redirect(url_for('dashboard'))
+
         # Update user credits
-        user.credits += selected_package["credits"]
+        add_credits(user.id, selected_package["credits"])
 
-        # Set expiry date 1 year from now
-        expiry_date = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
-        user.expiry_date = expiry_date
+        # Each purchase is its own lot, valid for 1 year from now
+        expiry_date = (datetime.now() + timedelta(days=CREDIT_VALIDITY_DAYS)).strftime("%Y-%m-%d")
 
         # Create credit transaction record
         transaction = CreditTransaction(
@@ -553,43 +3859,44 @@ def buy_package():
         )
 
         db.session.add(transaction)
+        add_credit_lot(user.id, selected_package["credits"], expiry_date, transaction=transaction)
+        refresh_expiry_summary(user.id)
         db.session.commit()
 
         flash(f'You have successfully purchased the {selected_name}! {selected_package["credits"]} credits added.', 'success')
         return redirect(url_for('dashboard'))
 
-    return render_template('buy_package.html', packages=packages, available_credits=available_credits)
+    return render_template(
+        'buy_package.html',
+        packages=CATALOG["packages"],
+        idempotency_key=new_idempotency_key()
+    )
     
 
 
 @app.route('/buy_credits',methods=["GET", "POST"])
+@login_required
 def buy_credits():
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
-
-    user = User.query.get(session['user_id'])
-    available_credits = user.credits
-
-    # Available top-up packs
-    credit_packs = [
-        {"credits": 10, "cost": 69, "bonus": 0},
-        {"credits": 27, "cost": 159, "bonus": 2},
-        {"credits": 55, "cost": 299, "bonus": 5},
-        {"credits": 115, "cost": 549, "bonus": 15}
-    ]
+    user = current_user()
 
     if request.method == 'POST':
-        selected_credits = int(request.form.get('credits'))
-        selected_bonus = int(request.form.get('bonus'))
-        selected_cost = float(request.form.get('cost'))
+        # Price and bonus come from the catalog, not from the submitted form
+        pack = find_topup(request.form.get('credits'))
+        if not pack:
+            flash('Invalid credit pack selection.', 'danger')
+            return redirect(url_for('buy_credits'))
+        selected_credits = pack["credits"]
+        selected_bonus = pack["bonus"]
 
         total_credits = selected_credits + selected_bonus
-        expiry_date = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
+        expiry_date = (datetime.now() + timedelta(days=CREDIT_VALIDITY_DAYS)).strftime("%Y-%m-%d")
 
-        # Update user credits and expiry
-        user.credits += total_credits
-        user.expiry_date = expiry_date
+        if not claim_idempotency_key(user.id, 'buy_credits'):
+            flash('This purchase was already processed.', 'info')
+            return redirect(url_for('dashboard'))
+
+        # Update user credits; the purchase is its own lot with its own expiry
+        add_credits(user.id, total_credits)
 
         # Log purchase
         transaction = CreditTransaction(
@@ -601,6 +3908,8 @@ def buy_credits():
         )
 
         db.session.add(transaction)
+        add_credit_lot(user.id, total_credits, expiry_date, transaction=transaction)
+        refresh_expiry_summary(user.id)
         db.session.commit()
 
         flash(f'Purchase successful! {total_credits} credits added to your account.', 'success')
@@ -608,38 +3917,210 @@ def buy_credits():
 
     return render_template(
         'buy_credits.html',
-        available_credits=available_credits,
-        credit_packs=credit_packs
+        credit_packs=CATALOG["topups"],
+        idempotency_key=new_idempotency_key()
     )
 
 
+TRANSACTIONS_PAGE_SIZE = 25
+CSV_EXPORT_BATCH_SIZE = 1000
+
+
+def transactions_page_query(user_id, cursor=None, model=CreditTransaction):
+    """One page of a user's credit transactions (or archived ones), newest first."""
+    query = db.session.query(
+        model.id, model.type, model.description, model.amount, model.created_at, model.expiry_date
+    ).filter(model.user_id == user_id)
+    if cursor:
+        query = query.filter(keyset_before(model.created_at, model.id, cursor))
+    return query.order_by(model.created_at.desc(), model.id.desc())
+
+
+def credit_totals(user_id):
+    """Total purchased and used credits for a user: recent rows summed in SQL, plus the archive snapshot."""
+    total_purchased, total_used = db.session.query(
+        db.func.coalesce(db.func.sum(db.case(
+            (CreditTransaction.amount > 0, CreditTransaction.amount), else_=0
+        )), 0),
+        db.func.coalesce(db.func.sum(db.case(
+            (CreditTransaction.amount < 0, -CreditTransaction.amount), else_=0
+        )), 0)
+    ).filter(CreditTransaction.user_id == user_id).one()
+    snapshot = db.session.get(ArchiveSnapshot, user_id)
+    if snapshot:
+        total_purchased += snapshot.total_purchased
+        total_used += snapshot.total_used
+    return total_purchased, total_used
+
+
 @app.route('/credit_history')
+@login_required
+@read_replica
 def credit_history():
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
+    user_id = session['user_id']
 
-    user = User.query.get(session['user_id'])
-    transactions = CreditTransaction.query.filter_by(user_id=user.id).order_by(CreditTransaction.created_at.desc()).all()
-    total_purchased = sum(t.amount for t in transactions if t.amount > 0)
-    total_used = sum(-t.amount for t in transactions if t.amount < 0)
-    current_balance = user.credits
+    # Fetch one extra row to know whether an older page exists
+    include_archived = request.args.get('archived') == '1'
+    cursor = decode_cursor(request.args.get('cursor'))
+    query = transactions_page_query(user_id, cursor=cursor)
+    if include_archived:
+        rows = newest_first([query, transactions_page_query(user_id, cursor=cursor, model=ArchivedCreditTransaction)],
+                            TRANSACTIONS_PAGE_SIZE + 1)
+    else:
+        rows = query.limit(TRANSACTIONS_PAGE_SIZE + 1).all()
+
+    transactions = rows[:TRANSACTIONS_PAGE_SIZE]
+    next_cursor = None
+    if len(rows) > TRANSACTIONS_PAGE_SIZE:
+        last = transactions[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    total_purchased, total_used = credit_totals(user_id)
 
     return render_template(
         'credit_history.html',
-        available_credits=current_balance,
         total_purchased=total_purchased,
         total_used=total_used,
-        transactions=transactions
+        transactions=transactions,
+        archived='1' if include_archived else None,
+        next_cursor=next_cursor,
+        is_first_page=cursor is None
+    )
+
+
+@app.route('/credit_history.csv')
+@login_required
+@read_replica
+def credit_history_csv():
+    user_id = session['user_id']
+    include_archived = request.args.get('archived') == '1'
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush():
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return data
+
+        writer.writerow(['date', 'type', 'description', 'amount', 'expires'])
+        yield flush()
+
+        def transactions(model):
+            return db.select(
+                model.created_at, model.type, model.description, model.amount, model.expiry_date, model.id
+            ).where(model.user_id == user_id)
+
+        statement = transactions(CreditTransaction)
+        if include_archived:
+            statement = db.select(
+                db.union_all(statement, transactions(ArchivedCreditTransaction)).subquery()
+            )
+        columns = statement.selected_columns
+
+        # stream_results asks the driver for a server-side cursor (psycopg2),
+        # and yield_per keeps only one batch of rows in memory at a time.
+        rows = db.session.execute(
+            statement.order_by(columns.created_at.desc(), columns.id.desc())
+            .execution_options(stream_results=True, yield_per=CSV_EXPORT_BATCH_SIZE)
+        )
+        for row in rows:
+            writer.writerow([
+                row.created_at.strftime("%Y-%m-%d %H:%M:%S") if row.created_at else '',
+                row.type,
+                row.description,
+                row.amount,
+                row.expiry_date or ''
+            ])
+            if buffer.tell() >= 64 * 1024:
+                yield flush()
+        yield flush()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=credit_history.csv'}
     )
 
+def usage_report(user_id, year, month=None):
+    """
+    Requests and credit usage for a calendar year (broken down by month) or
+    month (by day), read only from the daily rollups.
+    """
+    if month:
+        start = date(year, month, 1)
+        end = date(year + month // 12, month % 12 + 1, 1)
+        bucket = lambda day: day.isoformat()
+    else:
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+        bucket = lambda day: day.strftime('%Y-%m')
+
+    request_rows = db.session.query(DailyRequestStats).filter(
+        DailyRequestStats.user_id == user_id,
+        DailyRequestStats.day >= start,
+        DailyRequestStats.day < end
+    ).all()
+    credit_rows = db.session.query(DailyCreditStats).filter(
+        DailyCreditStats.user_id == user_id,
+        DailyCreditStats.day >= start,
+        DailyCreditStats.day < end
+    ).all()
+
+    status_columns = list(REQUEST_STATUS_COLUMNS.values())
+    credit_columns = ['purchased', 'used', 'expired', 'granted', 'adjusted']
+    by_service_type, breakdown = {}, {}
+    credits = dict.fromkeys(credit_columns, 0)
+
+    for row in request_rows:
+        counts = by_service_type.setdefault(row.service_type, dict.fromkeys(status_columns + ['total'], 0))
+        period = breakdown.setdefault(bucket(row.day), {'requests': 0, 'credits_used': 0})
+        for column in status_columns:
+            counts[column] += getattr(row, column)
+            counts['total'] += getattr(row, column)
+            period['requests'] += getattr(row, column)
+    for row in credit_rows:
+        for column in credit_columns:
+            credits[column] += getattr(row, column)
+        period = breakdown.setdefault(bucket(row.day), {'requests': 0, 'credits_used': 0})
+        period['credits_used'] += row.used
+
+    return {
+        'period': start.strftime('%Y-%m') if month else str(year),
+        'requests': {
+            'total': sum(counts['total'] for counts in by_service_type.values()),
+            'by_service_type': by_service_type,
+        },
+        'credits': credits,
+        'breakdown': dict(sorted(breakdown.items())),
+    }
+
+
+@app.route('/reports/usage')
+@login_required
+@read_replica
+def usage_report_view():
+    """JSON usage report: ?year=2026 for a year by month, add &month=10 for a month by day."""
+    today = utcnow().date()
+    try:
+        year = int(request.args.get('year', today.year))
+        month = int(request.args['month']) if request.args.get('month') else None
+        if not 2000 <= year <= 9999 or (month is not None and not 1 <= month <= 12):
+            raise ValueError
+    except ValueError:
+        return make_response({'error': 'year must be a four-digit year and month 1-12'}, 400)
+
+    response = make_response(usage_report(session['user_id'], year, month))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
 @app.route('/settings', methods=['GET', 'POST'])
+@login_required
+@read_replica
 def setting():
-    if 'user_id' not in session:
-        flash('Please login first.', 'info')
-        return redirect(url_for('login'))
-
-    user = User.query.get(session['user_id'])
+    user = current_user()
     current_balance = user.credits
     user_name = user.name 
     user_email = user.email
@@ -671,5 +4152,8 @@ def setting():
 
 
 if __name__ == '__main__':
+    # Local development convenience; deployments run `flask --app app upgrade-db`
+    with app.app_context():
+        upgrade_db()
     app.run(debug=True)
 
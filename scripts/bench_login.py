@@ -0,0 +1,136 @@
+"""
+Measures login throughput against password hash cost.
+
+For each hash method (and each PASSWORD_HASH_WORKERS setting) a fresh
+interpreter seeds a throwaway database, then --sessions threads log in
+through the Flask test client for --seconds while a probe thread requests
+the login page. Reports logins per second, login latency, how many logins
+were turned away as busy, and the probe's latency: the cost a login burst
+puts on every other route in the same worker.
+
+    python scripts/bench_login.py
+    python scripts/bench_login.py --methods pbkdf2:sha256:600000 scrypt:32768:8:1 --workers 0 2
+    python scripts/bench_login.py --sessions 16 --seconds 10 --output login.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_METHODS = ("pbkdf2:sha256:100000", "pbkdf2:sha256:600000", "scrypt:16384:8:1", "scrypt:32768:8:1")
+
+CHILD = """
+import json, statistics, sys, threading, time
+from werkzeug.security import generate_password_hash
+sys.path.insert(0, {root!r})
+import app
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000 if values else None
+
+with app.app.app_context():
+    app.upgrade_db()
+    stored = generate_password_hash("bench-password", {method!r})
+    app.db.session.execute(app.db.insert(app.User), [
+        {{"email": f"login{{i}}@example.com", "password": stored, "name": "Login"}} for i in range({sessions})
+    ])
+    app.db.session.commit()
+
+logins, probes, busy = [], [], [0]
+lock = threading.Lock()
+deadline = time.perf_counter() + {seconds}
+start = threading.Barrier({sessions} + 1)
+
+def session(n):
+    client = app.app.test_client()
+    start.wait()
+    while time.perf_counter() < deadline:
+        began = time.perf_counter()
+        response = client.post("/login", data={{"email": f"login{{n}}@example.com", "password": "bench-password"}})
+        with lock:
+            if response.status_code == 302:
+                logins.append(time.perf_counter() - began)
+            else:
+                busy[0] += 1
+
+def probe():
+    client = app.app.test_client()
+    start.wait()
+    while time.perf_counter() < deadline:
+        began = time.perf_counter()
+        client.get("/login")
+        probes.append(time.perf_counter() - began)
+        time.sleep(0.02)
+
+threads = [threading.Thread(target=session, args=(n,)) for n in range({sessions})] + [threading.Thread(target=probe)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+print(json.dumps({{
+    "logins_per_second": round(len(logins) / {seconds}, 1),
+    "login_p50_ms": percentile(logins, 50),
+    "login_p95_ms": percentile(logins, 95),
+    "busy": busy[0],
+    "probe_p50_ms": percentile(probes, 50),
+    "probe_p95_ms": percentile(probes, 95),
+}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS, help="werkzeug hash methods to compare")
+    parser.add_argument("--workers", nargs="+", type=int, default=[0, 1],
+                        help="PASSWORD_HASH_WORKERS settings to compare (0 hashes on the request thread)")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent login loops")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args()
+
+
+def run_once(method, workers, args):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'login.db')}",
+        SECRET_KEY="bench-login",
+        PASSWORD_HASH_METHOD=method,
+        PASSWORD_HASH_WORKERS=str(workers),
+        LOGIN_ATTEMPTS_PER_IP="0",
+        LOGIN_FAILURES_PER_ACCOUNT="0",
+    )
+    code = CHILD.format(root=ROOT, method=method, sessions=args.sessions, seconds=args.seconds)
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    print(f"{args.sessions} login sessions for {args.seconds:g}s on {os.cpu_count()} CPUs\n")
+    print(f"{'method':<24}{'workers':>8}{'logins/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'busy':>6}"
+          f"{'probe p50':>11}{'probe p95':>11}")
+
+    results = []
+    for method in args.methods:
+        for workers in args.workers:
+            r = run_once(method, workers, args)
+            results.append({"method": method, "workers": workers, **r})
+            fmt = lambda value: f"{value:.1f}" if value is not None else "-"
+            print(f"{method:<24}{workers:>8}{r['logins_per_second']:>10}{fmt(r['login_p50_ms']):>9}"
+                  f"{fmt(r['login_p95_ms']):>9}{r['busy']:>6}{fmt(r['probe_p50_ms']):>11}{fmt(r['probe_p95_ms']):>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"sessions": args.sessions, "seconds": args.seconds, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Measures notification outbox throughput offline.
+
+Queues messages in a throwaway SQLite database and drains the outbox
+through the stub transport, which sleeps to simulate the provider's
+round trip, at several dispatcher concurrency levels.
+
+    python scripts/bench_notifications.py --messages 2000 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated send time in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="comma-separated worker counts")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["NOTIFY_TRANSPORT"] = "stub"
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = app_module.db
+    results = []
+
+    with app_module.app.app_context():
+        app_module.upgrade_db()
+
+        for workers in [int(w) for w in args.concurrency.split(",")]:
+            db.session.execute(db.delete(app_module.Notification))
+            app_module.enqueue_notifications([
+                {"user_id": None, "recipient": f"+1555{n:07d}", "body": f"Message {n}", "dedupe_key": f"bench:{n}"}
+                for n in range(args.messages)
+            ])
+            db.session.commit()
+
+            app_module._notification_executor = ThreadPoolExecutor(max_workers=workers)
+            transport = app_module.StubTransport(latency=args.latency, failure_rate=args.failure_rate)
+
+            started = time.perf_counter()
+            while True:
+                sent, failed = app_module.dispatch_notifications(batch_size=args.batch_size, transport=transport)
+                if not sent and not failed:
+                    break
+            elapsed = time.perf_counter() - started
+            app_module._notification_executor.shutdown()
+
+            result = {
+                "concurrency": workers,
+                "messages": args.messages,
+                "delivered": len(transport.sent),
+                "seconds": round(elapsed, 3),
+                "messages_per_second": round(len(transport.sent) / elapsed, 1) if elapsed else None,
+            }
+            results.append(result)
+            print(f"concurrency={workers:>3}  delivered={result['delivered']:>6}  "
+                  f"{result['seconds']:>8}s  {result['messages_per_second']:>8} msg/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
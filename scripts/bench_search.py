@@ -0,0 +1,143 @@
+"""
+Compares request search through the full-text index with a LIKE scan.
+
+Seeds one heavy user with --rows requests of generated titles and briefs,
+then times the first page of results for a few query shapes through
+search_requests_query (FTS5 on SQLite, tsvector/GIN on PostgreSQL) and
+through the equivalent LIKE filter.
+
+    python scripts/bench_search.py --rows 100000
+    python scripts/bench_search.py --database-url postgresql://localhost/creativehub_search --output search.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMON_WORDS = ("logo", "banner", "brand", "colour", "modern", "clean", "bold", "minimal", "photo", "social")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to seed (default: temporary SQLite file)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct generated words")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args()
+
+
+def make_word(rng):
+    return "".join(rng.choice("bcdfghjklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(2, 4)))
+
+
+def seed(app_module, rows, vocabulary):
+    db = app_module.db
+    rng = random.Random(7)
+    words = sorted({make_word(rng) for _ in range(vocabulary)})
+    now = datetime.utcnow()
+
+    db.session.execute(db.insert(app_module.User), [{"email": "search@example.com", "password": "x", "name": "Search"}])
+    user_id = db.session.query(app_module.User.id).scalar()
+
+    pool = words + list(COMMON_WORDS) * (len(words) // 100)  # each common word in ~10% of text
+    batch = []
+    for n in range(rows):
+        batch.append({
+            "user_id": user_id,
+            "service_type": rng.choice(list(app_module.SERVICE_CREDIT_COST)),
+            "title": " ".join(rng.choice(pool) for _ in range(rng.randint(3, 5))).capitalize(),
+            "description": " ".join(rng.choice(pool) for _ in range(rng.randint(20, 40))),
+            "status": "Completed",
+            "created_at": now - timedelta(minutes=n),
+        })
+        if len(batch) == 5000:
+            db.session.execute(db.insert(app_module.ServiceRequest), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(app_module.ServiceRequest), batch)
+    db.session.commit()
+    return user_id, words
+
+
+def like_query(app_module, user_id, text):
+    """The obvious alternative: substring match on every word, newest first."""
+    ServiceRequest = app_module.ServiceRequest
+    db = app_module.db
+    query = db.session.query(ServiceRequest.id, ServiceRequest.title).filter(ServiceRequest.user_id == user_id)
+    for word in text.split():
+        pattern = f"%{word}%"
+        query = query.filter(db.or_(ServiceRequest.title.ilike(pattern), ServiceRequest.description.ilike(pattern)))
+    return query.order_by(ServiceRequest.created_at.desc(), ServiceRequest.id.desc())
+
+
+def timed(run, repeat):
+    run()  # warm caches
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), len(result)
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'search.db')}"
+    os.environ.setdefault("SECRET_KEY", "bench-search")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    flask_app, db = app_module.app, app_module.db
+    page = app_module.REQUESTS_PAGE_SIZE + 1
+    results = []
+
+    with flask_app.app_context():
+        app_module.upgrade_db()
+        started = time.perf_counter()
+        user_id, words = seed(app_module, args.rows, args.vocabulary)
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+        print(f"seeded {args.rows} requests in {time.perf_counter() - started:.1f}s ({db.engine.dialect.name})")
+
+        rng = random.Random(11)
+        queries = {
+            "rare word": rng.choice(words),
+            "common word": COMMON_WORDS[0],
+            "two words": f"{rng.choice(words)} {COMMON_WORDS[1]}",
+            "no match": "zzzzqqqq",
+        }
+
+        print(f"\n{'query':<14}{'index ms':>10}{'hits':>6}{'LIKE ms':>10}{'hits':>6}{'speedup':>9}")
+        for label, text in queries.items():
+            index_ms, index_hits = timed(
+                lambda: app_module.search_requests_query(user_id, text).limit(page).all(), args.repeat)
+            like_ms, like_hits = timed(lambda: like_query(app_module, user_id, text).limit(page).all(), args.repeat)
+            speedup = like_ms / index_ms if index_ms else None
+            print(f"{label:<14}{index_ms:>10.2f}{index_hits:>6}{like_ms:>10.2f}{like_hits:>6}{speedup:>8.1f}x")
+            results.append({
+                "query": label, "text": text,
+                "index_ms": round(index_ms, 3), "index_hits": index_hits,
+                "like_ms": round(like_ms, 3), "like_hits": like_hits,
+            })
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "database": db.engine.dialect.name, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
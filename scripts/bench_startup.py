@@ -0,0 +1,100 @@
+"""
+Measures the cold-start budget: importing app.py and serving the first request.
+
+Each run starts a fresh interpreter, times `import app` and then the first
+GET through the test client, and checks that slow integrations (Twilio,
+APScheduler) were not pulled in along the way. Prints the median and worst
+run; exits non-zero if the median exceeds --budget-ms or a lazy module was
+imported eagerly.
+
+    python scripts/bench_startup.py --runs 10 --budget-ms 800
+    python scripts/bench_startup.py --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only load on first use, never at import time
+LAZY_MODULES = ("twilio", "apscheduler")
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get({path!r})
+responded = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_response_ms": (responded - imported) * 1000,
+    "status": response.status_code,
+    "eager_modules": sorted({{m.split(".")[0] for m in sys.modules}} & set({lazy!r})),
+}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="page to request after import")
+    parser.add_argument("--budget-ms", type=float, help="fail if median import + first response exceeds this")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args()
+
+
+def run_once(path, env):
+    code = CHILD.format(path=path, lazy=LAZY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ)
+    # A database that doesn't exist yet: the first request must not need it
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    env.setdefault("SECRET_KEY", "bench-startup")
+
+    run_once(args.path, env)  # warm the bytecode cache, like a deployed image
+    runs = [run_once(args.path, env) for _ in range(args.runs)]
+
+    totals = [r["import_ms"] + r["first_response_ms"] for r in runs]
+    summary = {
+        "runs": args.runs,
+        "path": args.path,
+        "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "first_response_ms": round(statistics.median(r["first_response_ms"] for r in runs), 1),
+        "total_ms": round(statistics.median(totals), 1),
+        "worst_total_ms": round(max(totals), 1),
+        "eager_modules": sorted({m for r in runs for m in r["eager_modules"]}),
+        "statuses": sorted({r["status"] for r in runs}),
+    }
+
+    print(f"import {summary['import_ms']} ms, first response {summary['first_response_ms']} ms, "
+          f"total {summary['total_ms']} ms (worst {summary['worst_total_ms']} ms) over {args.runs} runs")
+
+    problems = []
+    if summary["eager_modules"]:
+        problems.append(f"imported at startup: {', '.join(summary['eager_modules'])}")
+    if any(status >= 500 for status in summary["statuses"]):
+        problems.append(f"first request failed: {summary['statuses']}")
+    if args.budget_ms and summary["total_ms"] > args.budget_ms:
+        problems.append(f"median {summary['total_ms']} ms is over the {args.budget_ms} ms budget")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "runs": runs}, f, indent=2)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
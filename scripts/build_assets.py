@@ -0,0 +1,146 @@
+"""
+Builds fingerprinted, precompressed static assets into static/dist/.
+
+- CSS/JS files get content-hashed names plus .gz and .br siblings.
+- Images get a content-hashed copy of the original plus resized WebP/AVIF
+  (and original-format) variants for srcset.
+- static/dist/manifest.json maps source paths to their built files; the app
+  reads it at startup and falls back to plain /static URLs without it.
+
+    python scripts/build_assets.py
+
+The output is committed: Vercel's Python builder runs no build step, so
+rerun this and commit static/dist/ whenever a file under static/ changes.
+
+Needs Pillow for images and the brotli package for .br files; either is
+skipped with a warning if it isn't installed.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+
+TEXT_EXTENSIONS = (".css", ".js")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+RESPONSIVE_WIDTHS = (480, 960, 1600)
+IMAGE_QUALITY = {"avif": 50, "webp": 75, "jpeg": 80}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(path, data, suffix=""):
+    base, ext = os.path.splitext(path)
+    return f"{base}{suffix}.{content_hash(data)}{ext}"
+
+
+def write(relpath, data):
+    target = os.path.join(DIST_DIR, relpath)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        f.write(data)
+
+
+def source_files():
+    for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != DIST_DIR]
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            yield os.path.relpath(path, STATIC_DIR).replace(os.sep, "/"), path
+
+
+def build_text(relpath, data, manifest):
+    name = hashed_name(relpath, data)
+    write(name, data)
+    encodings = ["gzip"]
+    write(name + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli:
+        write(name + ".br", brotli.compress(data, quality=11))
+        encodings.insert(0, "br")
+    manifest["files"][relpath] = name
+    manifest["encodings"][name] = encodings
+    return name
+
+
+def build_image(relpath, data, path, manifest):
+    name = hashed_name(relpath, data)
+    write(name, data)
+    manifest["files"][relpath] = name
+    if Image is None:
+        return name
+
+    formats = ["webp", "jpeg" if relpath.lower().endswith((".jpg", ".jpeg")) else "png"]
+    if features.check("avif"):
+        formats.insert(0, "avif")
+
+    with Image.open(path) as original:
+        width, height = original.size
+        widths = [w for w in RESPONSIVE_WIDTHS if w < width] + [width]
+        variants = {}
+        for fmt in formats:
+            variants[fmt] = []
+            for w in widths:
+                image = original if w == width else original.resize(
+                    (w, round(height * w / width)), Image.LANCZOS
+                )
+                if image.mode not in ("RGB", "RGBA") or (fmt == "jpeg" and image.mode == "RGBA"):
+                    image = image.convert("RGB")
+                buffer = BytesIO()
+                options = {"quality": IMAGE_QUALITY[fmt]} if fmt in IMAGE_QUALITY else {"optimize": True}
+                image.save(buffer, fmt.upper(), **options)
+                variant = buffer.getvalue()
+                ext = {"jpeg": os.path.splitext(relpath)[1]}.get(fmt, f".{fmt}")
+                variant_name = hashed_name(os.path.splitext(relpath)[0] + ext, variant, f".{w}w")
+                write(variant_name, variant)
+                variants[fmt].append([w, variant_name])
+
+    manifest["images"][relpath] = {"width": width, "height": height, "variants": variants}
+    return name
+
+
+def main():
+    if Image is None:
+        print("warning: Pillow not installed, images are fingerprinted but not resized")
+    if brotli is None:
+        print("warning: brotli not installed, only gzip files are written")
+
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    manifest = {"files": {}, "images": {}, "encodings": {}}
+
+    for relpath, path in source_files():
+        with open(path, "rb") as f:
+            data = f.read()
+        lower = relpath.lower()
+        if lower.endswith(TEXT_EXTENSIONS):
+            built = build_text(relpath, data, manifest)
+        elif lower.endswith(IMAGE_EXTENSIONS):
+            built = build_image(relpath, data, path, manifest)
+        else:
+            continue
+        print(f"{relpath} -> {built}")
+
+    write("manifest.json", json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
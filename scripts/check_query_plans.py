@@ -0,0 +1,175 @@
+"""
+Fails if a hot query falls back to a full table scan.
+
+Seeds a throwaway database, drives the authenticated pages with the Flask
+test client, captures every SELECT they issue and runs EXPLAIN on it.
+
+    python scripts/check_query_plans.py
+    python scripts/check_query_plans.py --database-url postgresql://localhost/creativehub_check
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tables that grow with usage; a full scan on any of these is a failure.
+HOT_TABLES = ("service_request", "credit_transaction", "service_request_archive", "credit_transaction_archive",
+              "attachment")
+
+# Pages to drive, with the query strings that select different query shapes.
+PAGES = (
+    "/dashboard",
+    "/my_requests",
+    "/my_requests?status=Pending",
+    "/my_requests?service_type=logo",
+    "/my_requests?archived=1",
+    "/credit_history",
+    "/credit_history?archived=1",
+    "/credit_history.csv",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to seed (default: temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows-per-user", type=int, default=200)
+    return parser.parse_args()
+
+
+def seed(app_module, users, rows_per_user):
+    from werkzeug.security import generate_password_hash
+
+    db = app_module.db
+    password = generate_password_hash("check-password")
+    now = datetime.utcnow()
+    rng = random.Random(42)
+
+    db.session.execute(db.insert(app_module.User), [
+        {"email": f"user{i}@example.com", "password": password, "name": f"User {i}"}
+        for i in range(users)
+    ])
+    user_ids = [u for (u,) in db.session.query(app_module.User.id)]
+
+    services = list(app_module.SERVICE_CREDIT_COST)
+    requests, transactions = [], []
+    for user_id in user_ids:
+        for n in range(rows_per_user):
+            created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            requests.append({
+                "user_id": user_id,
+                "service_type": rng.choice(services),
+                "title": f"Request {n}",
+                "description": "Brief " * 20,
+                "status": rng.choice(app_module.REQUEST_STATUSES),
+                "created_at": created_at,
+            })
+            transactions.append({
+                "user_id": user_id,
+                "type": rng.choice(("purchase", "use", "use", "use", "expiry")),
+                "description": f"Transaction {n}",
+                "amount": rng.choice((-5, -3, -2, 50)),
+                "created_at": created_at,
+            })
+    db.session.execute(db.insert(app_module.ServiceRequest), requests)
+    db.session.execute(db.insert(app_module.CreditTransaction), transactions)
+    db.session.commit()
+
+
+def explain(conn, dialect, statement, parameters):
+    """Return the plan lines for a statement on SQLite or PostgreSQL."""
+    cursor = conn.connection.cursor()
+    if dialect == "sqlite":
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    cursor.execute("EXPLAIN " + statement, parameters)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def full_scans(dialect, plan):
+    scans = []
+    for line in plan:
+        for table in HOT_TABLES:
+            if dialect == "sqlite" and line.startswith(f"SCAN {table}"):
+                scans.append(line)
+            elif dialect != "sqlite" and f"Seq Scan on {table}" in line:
+                scans.append(line)
+    return scans
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'check.db')}"
+    os.environ.setdefault("SECRET_KEY", "check-query-plans")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from sqlalchemy import event
+
+    flask_app, db = app_module.app, app_module.db
+
+    with flask_app.app_context():
+        app_module.upgrade_db()
+        seed(app_module, args.users, args.rows_per_user)
+        engine = db.engine
+        dialect = engine.dialect.name
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and any(t in statement for t in HOT_TABLES):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    client = flask_app.test_client()
+    client.post("/login", data={"email": "user0@example.com", "password": "check-password"})
+
+    for page in PAGES:
+        response = client.get(page)
+        if response.status_code != 200:
+            print(f"{page} returned {response.status_code}")
+            return 1
+
+        # Follow the cursor once so the keyset predicate is covered too
+        if "cursor=" in response.get_data(as_text=True) and "?" not in page:
+            body = response.get_data(as_text=True)
+            cursor = body.split("cursor=", 1)[1].split('"', 1)[0]
+            client.get(f"{page}?cursor={cursor}")
+    event.remove(engine, "before_cursor_execute", capture)
+
+    failures = 0
+    with flask_app.app_context(), db.engine.connect() as conn:
+        if dialect == "postgresql":
+            # Small seeded tables make sequential scans cheap; force the
+            # planner to show whether an index path exists at all.
+            conn.exec_driver_sql("SET enable_seqscan = off")
+
+        seen = set()
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(conn, dialect, statement, parameters)
+            scans = full_scans(dialect, plan)
+            status = "FULL SCAN" if scans else "ok"
+            print(f"[{status}] {' '.join(statement.split())[:120]}")
+            for line in plan:
+                print(f"    {line}")
+            failures += bool(scans)
+
+    print(f"\n{len(seen)} queries checked, {failures} with full table scans.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
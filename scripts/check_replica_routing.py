@@ -0,0 +1,130 @@
+"""
+Checks read-replica routing and read-your-writes pinning.
+
+Drives the app with the Flask test client and records which engine each
+step's statements ran on: form posts and the pages right after them must
+use the primary, and the read-only pages must use the replica once the
+user's post-write window has passed.
+
+By default the primary and replica are two SQLite files; the replica is a
+copy taken after signup, so it is a "lagging" replica and the check also
+confirms that a request submitted afterwards is only visible while pinned.
+With --replica-url, point it at a real replica of --database-url (the
+staleness check is skipped since replication keeps it up to date).
+
+    python scripts/check_replica_routing.py
+    python scripts/check_replica_routing.py --database-url postgresql://localhost:5432/creativehub \\
+        --replica-url postgresql://localhost:5433/creativehub
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "replica-password"
+
+# Read-only pages that should be served by the replica
+READ_PAGES = (
+    "/dashboard",
+    "/my_requests",
+    "/credit_history",
+    "/credit_history.csv",
+    "/settings",
+    "/reports/usage",
+    "/api/status",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="primary database (default: temporary SQLite file)")
+    parser.add_argument("--replica-url", help="replica of the primary (default: a copy of the SQLite file)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if bool(args.database_url) != bool(args.replica_url):
+        print("--database-url and --replica-url go together")
+        return 2
+    tmpdir = tempfile.mkdtemp()
+    primary_path = os.path.join(tmpdir, "primary.db")
+    replica_path = os.path.join(tmpdir, "replica.db")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{primary_path}"
+    os.environ["DATABASE_REPLICA_URLS"] = args.replica_url or f"sqlite:///{replica_path}"
+    os.environ.setdefault("SECRET_KEY", "check-replicas")
+    os.environ.setdefault("NOTIFY_TRANSPORT", "stub")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from sqlalchemy import event
+
+    flask_app, db = app_module.app, app_module.db
+    email = f"replica-{uuid.uuid4().hex[:8]}@example.com"
+
+    with flask_app.app_context():
+        app_module.upgrade_db()
+        primary = db.engine
+        replica = db.engines[app_module.REPLICA_BINDS[0]]
+    client = flask_app.test_client()
+    client.post("/signup", data={"name": "Replica", "email": email, "password": PASSWORD})
+    if not args.replica_url:
+        primary.dispose()
+        shutil.copyfile(primary_path, replica_path)
+
+    used = set()
+    event.listen(primary, "before_cursor_execute", lambda *a: used.add("primary"))
+    event.listen(replica, "before_cursor_execute", lambda *a: used.add("replica"))
+
+    problems = []
+
+    def step(label, expected, method, path, **kwargs):
+        used.clear()
+        response = getattr(client, method)(path, **kwargs)
+        body = response.get_data(as_text=True)
+        engines = ", ".join(sorted(used)) or "-"
+        print(f"{label:<44}{response.status_code:>5}  {engines}")
+        if response.status_code >= 500:
+            problems.append(f"{label} returned {response.status_code}")
+        elif used != {expected}:
+            problems.append(f"{label} used {engines}, expected only the {expected}")
+        return body
+
+    def expire_pin():
+        with client.session_transaction() as sess:
+            sess["primary_until"] = 0
+
+    print(f"{'step':<44}{'status':>5}  engines")
+    step("POST /login", "primary", "post", "/login", data={"email": email, "password": PASSWORD})
+    step("GET /dashboard (just logged in)", "primary", "get", "/dashboard")
+
+    expire_pin()
+    for path in READ_PAGES:
+        step(f"GET {path}", "replica", "get", path)
+
+    title = f"Replica check {uuid.uuid4().hex[:6]}"
+    step("POST /new_request", "primary", "post", "/new_request", data={
+        "service_type": "logo", "request_title": title,
+        "description": "Submitted while reads go to a replica",
+        "idempotency_key": app_module.new_idempotency_key(),
+    })
+    if title not in step("GET /my_requests (just submitted)", "primary", "get", "/my_requests"):
+        problems.append("the new request is missing right after submitting it")
+
+    expire_pin()
+    body = step("GET /my_requests (window passed)", "replica", "get", "/my_requests")
+    if not args.replica_url and title in body:
+        problems.append("the lagging replica copy shows the new request, so it wasn't the replica answering")
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: reads go to the replica, writes and just-written pages to the primary")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Checks chunked attachment uploads: resuming, deduplication, limits and memory.
+
+Drives the upload API with the Flask test client against a throwaway
+database and UPLOAD_DIR: uploads a file in chunks with a repeated and an
+out-of-order chunk in between and a late duplicate write of an accepted
+chunk, reads the resume offset back, downloads the attachment and compares
+bytes, uploads the same content again to confirm it
+is stored once, attaches it by hash without sending it, and checks that a
+file past the per-request limit and a wrong declared hash are refused.
+Python allocations while a chunk streams in must stay far below its size.
+
+    python scripts/check_uploads.py
+    python scripts/check_uploads.py --size-mb 20
+    python scripts/check_uploads.py --database-url postgresql://localhost/creativehub_check
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import tracemalloc
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "upload-password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to use (default: temporary SQLite file)")
+    parser.add_argument("--size-mb", type=int, default=10, help="size of the test file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'uploads.db')}"
+    os.environ["UPLOAD_DIR"] = os.path.join(tmpdir, "store")
+    os.environ.setdefault("SECRET_KEY", "check-uploads")
+    os.environ.setdefault("NOTIFY_TRANSPORT", "stub")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    flask_app, db = app_module.app, app_module.db
+    with flask_app.app_context():
+        app_module.upgrade_db()
+
+    client = flask_app.test_client()
+    email = f"uploads-{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/signup", data={"name": "Uploads", "email": email, "password": PASSWORD})
+    client.post("/login", data={"email": email, "password": PASSWORD})
+    client.post("/new_request", data={
+        "service_type": "logo", "request_title": "Brand kit", "description": "Logo with attachments",
+        "idempotency_key": app_module.new_idempotency_key(),
+    })
+    with flask_app.app_context():
+        request_id = db.session.query(db.func.max(app_module.ServiceRequest.id)).scalar()
+    create_url = f"/api/requests/{request_id}/uploads"
+
+    problems = []
+
+    def expect(label, response, status):
+        print(f"{label:<48}{response.status_code:>5}")
+        if response.status_code != status:
+            problems.append(f"{label} returned {response.status_code}, expected {status}: {response.get_data(as_text=True)[:200]}")
+        return response.get_json(silent=True) or {}
+
+    def put(state, start, end, body=None):
+        data = body if body is not None else content[start:end]
+        return client.put(state["url"], data=data, headers={"Content-Range": f"bytes {start}-{end - 1}/{state['size']}"})
+
+    content = os.urandom(args.size_mb * 1024 * 1024)
+    digest = hashlib.sha256(content).hexdigest()
+
+    state = expect("create upload", client.post(create_url, json={"filename": "brand kit.zip", "size": len(content)}), 201)
+    chunk = state["chunk_size"]
+    expect("first chunk", put(state, 0, chunk), 200)
+    expect("same chunk again (offset moved on)", put(state, 0, chunk), 409)
+    expect("chunk past the offset", put(state, 2 * chunk, min(3 * chunk, len(content))), 409)
+    resumed = expect("resume offset", client.get(state["url"]), 200)
+    if resumed.get("offset") != chunk:
+        problems.append(f"resume offset is {resumed.get('offset')}, expected {chunk}")
+
+    # Allocations while the next chunk streams to disk
+    tracemalloc.start()
+    offset = resumed["offset"]
+    end = min(offset + chunk, len(content))
+    body = content[offset:end]
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    state = expect("streamed chunk", put(state, offset, end, body), 200)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    print(f"  peak allocation while streaming a {len(body) // 1024} KiB chunk: {peak // 1024} KiB")
+    if peak > len(body) // 2:
+        problems.append(f"a {len(body)} byte chunk allocated {peak} bytes; it looks buffered")
+
+    # A retried copy of the first chunk that passed the offset check before
+    # the chunks above were accepted, and only writes now
+    store = app_module.get_object_store()
+    store.write_part(state["upload_id"], 0, chunk, [content[:chunk]])
+
+    offset = state.get("offset", len(content))
+    while "attachment" not in state and not problems:
+        end = min(offset + chunk, len(content))
+        state = expect(f"chunk at {offset}", put(state, offset, end), 200)
+        offset = state.get("offset", len(content))
+    attachment = state.get("attachment") or {}
+    if attachment.get("sha256") != digest:
+        problems.append("the finished attachment has the wrong hash")
+
+    download = client.get(attachment.get("url", "/attachments/0"))
+    expect("download", download, 200)
+    if download.get_data() != content:
+        problems.append("downloaded bytes differ from the upload")
+    download.close()
+
+    again = expect("upload the same file again", client.post(create_url, json={"filename": "copy.zip", "size": len(content)}), 201)
+    offset = 0
+    while "attachment" not in again and not problems:
+        end = min(offset + chunk, len(content))
+        again = expect(f"repeat chunk at {offset}", put(again, offset, end), 200)
+        offset = again.get("offset", len(content))
+    by_hash = expect("attach by hash", client.post(create_url, json={
+        "filename": "third.zip", "size": len(content), "sha256": digest}), 201)
+    if not by_hash.get("deduplicated"):
+        problems.append("a known hash was uploaded again instead of attached directly")
+
+    blobs = [name for _, _, names in os.walk(os.path.join(os.environ["UPLOAD_DIR"], "blobs")) for name in names]
+    print(f"  3 attachments, {len(blobs)} stored blob(s)")
+    if blobs != [digest]:
+        problems.append(f"expected one stored blob, found {len(blobs)}")
+
+    with flask_app.app_context():
+        limit = app_module.attachment_limit(app_module.User.query.filter_by(email=email).one())
+    expect("file past the request's limit", client.post(create_url, json={"filename": "huge.mov", "size": limit}), 413)
+
+    small = os.urandom(1000)
+    wrong = expect("declared hash", client.post(create_url, json={
+        "filename": "wrong.png", "size": len(small), "sha256": "0" * 64}), 201)
+    expect("content not matching the hash", put(wrong, 0, len(small), small), 422)
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: uploads resume, stream without buffering, dedupe and respect limits")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Offline load test: concurrent simulated sessions against a seeded database.
+
+Seeds users with request and credit history, then runs sessions in threads
+through the Flask test client. Each session logs in and repeats
+dashboard -> new request -> my requests (plus the next page) -> credit
+history. Reports p50/p95/p99 latency, throughput and SQL queries per request
+for every route, and can save the results as JSON and compare two runs.
+
+    python scripts/loadtest.py --users 200 --requests-per-user 500 --sessions 8
+    python scripts/loadtest.py --output before.json
+    python scripts/loadtest.py --output after.json --compare before.json
+    python scripts/loadtest.py --database-url postgresql://localhost/creativehub_load
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "load-password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to seed (default: temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests-per-user", type=int, default=200)
+    parser.add_argument("--transactions-per-user", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=20, help="journeys per session")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed p95 slowdown against the baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def seed(app_module, users, requests_per_user, transactions_per_user):
+    from werkzeug.security import generate_password_hash
+
+    db = app_module.db
+    password = generate_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    balance = 10 ** 6  # enough that submissions never run out mid-test
+
+    db.session.execute(db.insert(app_module.User), [
+        {"email": f"load{i}@example.com", "password": password, "name": f"Load {i}", "credits": balance}
+        for i in range(users)
+    ])
+    user_ids = [u for (u,) in db.session.query(app_module.User.id)]
+    db.session.execute(db.insert(app_module.CreditLot), [
+        {"user_id": user_id, "amount": balance, "remaining": balance, "expires_at": None}
+        for user_id in user_ids
+    ])
+
+    services = list(app_module.SERVICE_CREDIT_COST)
+    for user_id in user_ids:
+        requests, transactions = [], []
+        for n in range(requests_per_user):
+            created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            status = rng.choice(app_module.REQUEST_STATUSES)
+            requests.append({
+                "user_id": user_id,
+                "service_type": rng.choice(services),
+                "title": f"Request {n}",
+                "description": "Brief " * 20,
+                "status": status,
+                "created_at": created_at,
+                "completed_at": created_at + timedelta(minutes=10) if status == "Completed" else None,
+            })
+        for n in range(transactions_per_user):
+            transactions.append({
+                "user_id": user_id,
+                "type": rng.choice(("purchase", "use", "use", "use", "expiry")),
+                "description": f"Transaction {n}",
+                "amount": rng.choice((-5, -3, -2, 50)),
+                "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            })
+        if requests:
+            db.session.execute(db.insert(app_module.ServiceRequest), requests)
+        if transactions:
+            db.session.execute(db.insert(app_module.CreditTransaction), transactions)
+    db.session.execute(app_module.rebuild_counters_statement())
+    db.session.commit()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for route, entries in sorted(samples.items()):
+        latencies = sorted(ms for ms, _, _ in entries)
+        routes[route] = {
+            "count": len(entries),
+            "errors": sum(1 for _, _, status in entries if status >= 500),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(statistics.fmean(latencies), 2),
+            "queries_per_request": round(statistics.fmean(q for _, q, _ in entries), 2),
+            "requests_per_second": round(len(entries) / elapsed, 1),
+        }
+    total = sum(r["count"] for r in routes.values())
+    return routes, {"requests": total, "seconds": round(elapsed, 3), "requests_per_second": round(total / elapsed, 1)}
+
+
+def compare(routes, baseline, threshold):
+    """Print per-route changes against a baseline run; return the regressions."""
+    regressions = []
+    print(f"\n{'route':<28}{'p95 before':>12}{'p95 after':>12}{'change':>9}{'queries':>14}")
+    for route, result in routes.items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0
+        queries = f"{before['queries_per_request']} -> {result['queries_per_request']}"
+        print(f"{route:<28}{before['p95_ms']:>12}{result['p95_ms']:>12}{change:>+9.0%}{queries:>14}")
+        if change > threshold:
+            regressions.append(f"{route} p95 is {change:+.0%} against the baseline")
+        if result["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(f"{route} issues more queries per request than the baseline")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'load.db')}"
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    os.environ.setdefault("NOTIFY_TRANSPORT", "stub")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from sqlalchemy import event
+
+    flask_app, db = app_module.app, app_module.db
+
+    started = time.perf_counter()
+    with flask_app.app_context():
+        app_module.upgrade_db()
+        seed(app_module, args.users, args.requests_per_user, args.transactions_per_user)
+        engine = db.engine
+    print(f"seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    # Requests run on the calling thread, so a thread-local counter sees
+    # exactly the queries issued by the request being timed.
+    counter = threading.local()
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, "queries", 0) + 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+
+    samples = {}
+    lock = threading.Lock()
+    start = threading.Barrier(args.sessions)
+
+    def timed(client, route, method, path, **kwargs):
+        counter.queries = 0
+        began = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        elapsed_ms = (time.perf_counter() - began) * 1000
+        with lock:
+            samples.setdefault(route, []).append((elapsed_ms, counter.queries, response.status_code))
+        return response
+
+    def session(n):
+        rng = random.Random(n)
+        client = flask_app.test_client()
+        email = f"load{n % args.users}@example.com"
+        start.wait()
+        timed(client, "POST /login", "post", "/login", data={"email": email, "password": PASSWORD})
+        for i in range(args.iterations):
+            timed(client, "GET /dashboard", "get", "/dashboard")
+            timed(client, "GET /new_request", "get", "/new_request")
+            timed(client, "POST /new_request", "post", "/new_request", data={
+                "service_type": rng.choice(list(app_module.SERVICE_CREDIT_COST)),
+                "request_title": f"Load {n}-{i}",
+                "description": "Load test submission",
+                "idempotency_key": uuid.uuid4().hex,
+            })
+            body = timed(client, "GET /my_requests", "get", "/my_requests").get_data(as_text=True)
+            if "cursor=" in body:
+                cursor = body.split("cursor=", 1)[1].split('"', 1)[0]
+                timed(client, "GET /my_requests?cursor", "get", f"/my_requests?cursor={cursor}")
+            timed(client, "GET /credit_history", "get", "/credit_history")
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(args.sessions)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count_query)
+
+    routes, total = summarize(samples, elapsed)
+    print(f"\n{'route':<28}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'errors':>8}")
+    for route, r in routes.items():
+        print(f"{route:<28}{r['count']:>7}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+              f"{r['queries_per_request']:>9}{r['errors']:>8}")
+    print(f"\n{total['requests']} requests in {total['seconds']}s, {total['requests_per_second']} req/s")
+
+    results = {
+        "commit": git_commit(),
+        "database": engine.dialect.name,
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "database_url")},
+        "total": total,
+        "routes": routes,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    problems = [f"{route} returned {r['errors']} server errors" for route, r in routes.items() if r["errors"]]
+    if args.compare:
+        with open(args.compare) as f:
+            problems += compare(routes, json.load(f), args.threshold)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Hammers one account from many threads and checks the credit ledger still balances.
+
+Every thread logs in as the same user and mixes request submissions, top-up
+purchases and resubmissions of an already-used idempotency key. Afterwards
+the balance must be non-negative and equal both the ledger sum and the sum
+of the user's credit lots, and no idempotency key may have been applied twice.
+
+    python scripts/stress_credits.py --threads 16 --iterations 25
+    python scripts/stress_credits.py --database-url postgresql://localhost/creativehub_stress
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to use (default: temporary SQLite file)")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=25)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'stress.db')}"
+    os.environ.setdefault("SECRET_KEY", "stress-credits")
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    flask_app, db = app_module.app, app_module.db
+    email, password = f"stress-{uuid.uuid4().hex[:8]}@example.com", "stress-password"
+
+    with flask_app.app_context():
+        app_module.upgrade_db()
+    flask_app.test_client().post("/signup", data={"name": "Stress", "email": email, "password": password})
+
+    outcomes = {"submitted": 0, "rejected": 0, "purchased": 0, "replayed": 0, "errors": 0}
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def record(outcome):
+        with lock:
+            outcomes[outcome] += 1
+
+    def worker(n):
+        client = flask_app.test_client()
+        client.post("/login", data={"email": email, "password": password})
+        start.wait()
+        for i in range(args.iterations):
+            key = uuid.uuid4().hex
+            if i % 5 == 4:
+                form = {"credits": "10", "bonus": "0", "cost": "69", "idempotency_key": key}
+                paths = ["/buy_credits", "/buy_credits"]  # double-click
+            else:
+                form = {"service_type": "logo", "request_title": f"Stress {n}-{i}",
+                        "description": "Concurrent submission", "idempotency_key": key}
+                paths = ["/new_request", "/new_request"] if i % 3 == 0 else ["/new_request"]
+
+            for attempt, path in enumerate(paths):
+                response = client.post(path, data=form)
+                if response.status_code >= 500:
+                    record("errors")
+                    continue
+                with client.session_transaction() as sess:
+                    flashes = sess.pop("_flashes", [])
+                message = flashes[-1][1] if flashes else ""
+                if "already" in message:
+                    record("replayed")
+                elif "enough credits" in message:
+                    record("rejected")
+                elif path == "/buy_credits":
+                    record("purchased")
+                else:
+                    record("submitted")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with flask_app.app_context():
+        user = app_module.User.query.filter_by(email=email).one()
+        ledger = db.session.query(db.func.coalesce(db.func.sum(app_module.CreditTransaction.amount), 0)).filter(
+            app_module.CreditTransaction.user_id == user.id).scalar()
+        lots = db.session.query(db.func.coalesce(db.func.sum(app_module.CreditLot.remaining), 0)).filter(
+            app_module.CreditLot.user_id == user.id).scalar()
+        requests = app_module.ServiceRequest.query.filter_by(user_id=user.id).count()
+        purchases = app_module.CreditTransaction.query.filter_by(user_id=user.id, type="purchase").count()
+
+    print(f"outcomes: {outcomes}")
+    print(f"balance={user.credits} ledger={ledger} lots={lots} requests={requests} purchases={purchases}")
+
+    problems = []
+    if user.credits < 0:
+        problems.append("balance went negative")
+    if user.credits != ledger:
+        problems.append("balance doesn't match ledger")
+    if user.credits != lots:
+        problems.append("balance doesn't match credit lots")
+    if requests != outcomes["submitted"]:
+        problems.append("request count doesn't match successful submissions")
+    if purchases != outcomes["purchased"]:
+        problems.append("purchase count doesn't match successful purchases")
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: ledger balances")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())